@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks the CG data pipeline on the real conversations and on copies of
+them tiled to a multiple of their length (or synthetic conversations of the
+same length with --synthetic).
+
+Results are appended to a jsonl file keyed by git commit and compared to the
+most recent run from a different commit. Each result is appended as soon as
+it is measured so an interrupted run keeps what it finished.
+
+Usage Examples:
+    $ benchmark_cg.py                          # No args needed.
+    $ benchmark_cg.py --scales 1 --repeat 5    # Skip the 10x run.
+    $ benchmark_cg.py --scales 100 --stages load --cids 4248
+    $ benchmark_cg.py --stages load load_events
+    $ benchmark_cg.py --synthetic --scales 10 100
+"""
+import functools
+import os
+import re
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from glob import glob
+from typing import Any, Callable
+
+import pandas as pd
+from more_itertools import one
+
+from src.core.app import harness
+from src.core.context import Context
+from src.core.path import dirparent
+from src.data import cg, synthetic
+
+import generate_yn_questions as gyq
+
+
+BENCH_DIR = os.path.join(dirparent(os.path.realpath(__file__), 2), "data", "benchmarks")
+BENCH_PATH = os.path.join(BENCH_DIR, "cg.jsonl")
+# Each stage does any untimed setup for a (cid, annotator, path) and returns
+# the call to measure.
+STAGES: dict[str, Callable[[int, str, str], Callable[[], Any]]] = {
+    "load": lambda *args: functools.partial(cg.load, *args),
+    "load_events": lambda *args: functools.partial(cg.load_events, *args),
+    "filter_to_interesting_events": lambda *args: functools.partial(
+        gyq.filter_to_interesting_events, cg.load_events(*args)
+    ),
+    "generate_yn_questions": lambda *args: functools.partial(
+        gyq.generate_yn_questions, *args
+    ),
+}
+
+
+def tile(path: str, factor: int, outpath: str) -> str:
+    """
+    Writes a copy of a CG tsv repeated `factor` times with the sentence
+    numbers of each copy (in Eno. and in annotations) shifted past the last.
+    """
+    df = pd.read_table(path, dtype=str, keep_default_na=False)
+    nsno = int(max(float(eno) for eno in df["Eno."] if eno))
+    anns = [col for col in df.columns if re.match(r"^(Bel|CG)\([AB]\)$", col)]
+
+    def shift(string: str, offset: int) -> str:
+        return re.sub(
+            r"\b(\d+)(\.\d+)?\b",
+            lambda m: f"{int(m.group(1)) + offset}{m.group(2) or ''}",
+            string,
+        )
+
+    ret = []
+    for idx in range(factor):
+        copy = df.copy()
+        for col in ["Eno."] + anns:
+            copy[col] = [shift(val, idx * nsno) for val in copy[col]]
+        ret.append(copy)
+    pd.concat(ret).to_csv(outpath, sep="\t", index=False)
+    return outpath
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    # Measure memory separately since tracing skews timings.
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "min_seconds": min(times),
+        "mean_seconds": sum(times) / len(times),
+        "peak_mib": peak / 2**20,
+    }
+
+
+def commit() -> str:
+    cproc = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        capture_output=True,
+        check=True,
+        cwd=dirparent(os.path.realpath(__file__), 2),
+    )
+    return cproc.stdout.decode("utf-8").strip()
+
+
+def compare(results: pd.DataFrame, history: pd.DataFrame) -> pd.DataFrame:
+    keys = ["stage", "scale", "cid", "synthetic"]
+    if not history.empty:
+        history = history[~history.commit.isin(results.commit)]
+        history = history.assign(synthetic=history.get("synthetic", False))
+    if history.empty:
+        return results[keys + ["min_seconds", "peak_mib"]]
+    prev = history[history.timestamp == history.timestamp.max()]
+    ret = results.merge(prev, how="left", on=keys, suffixes=("", "_prev"))
+    ret["speedup"] = ret.min_seconds_prev / ret.min_seconds
+    return ret[keys + ["min_seconds", "min_seconds_prev", "speedup", "peak_mib"]]
+
+
+def main(ctx: Context) -> None:
+    ctx.parser.add_argument("-a", "--annotator", default="Magda")
+    ctx.parser.add_argument("-c", "--cids", nargs="+", type=int, default=cg.CIDS)
+    ctx.parser.add_argument("-s", "--scales", nargs="+", type=int, default=[1, 10])
+    ctx.parser.add_argument("--stages", nargs="+", choices=STAGES, default=[*STAGES])
+    ctx.parser.add_argument("-r", "--repeat", type=int, default=3)
+    ctx.parser.add_argument("--synthetic", action="store_true")
+    ctx.parser.add_argument("-o", "--outpath", default=BENCH_PATH)
+    args = ctx.parser.parse_args()
+    history = pd.DataFrame()
+    if os.path.exists(args.outpath):
+        history = pd.read_json(
+            args.outpath,
+            lines=True,
+            dtype={"commit": str, "timestamp": str},
+            convert_dates=False,
+        )
+    os.makedirs(os.path.dirname(args.outpath), exist_ok=True)
+    # Run benchmarks.
+    rows = []
+    sha, timestamp = commit(), time.strftime("%Y%m%d.%H%M%S")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for cid, scale in ((cid, scale) for scale in args.scales for cid in args.cids):
+            path = one(glob(os.path.join(cg.CG_DIR, f"{cid}*{args.annotator}*.tsv")))
+            if args.synthetic:
+                nturns = int(cg.load(cid, args.annotator)["Sno."].max())
+                outdir = os.path.join(tmpdir, f"{scale}x")
+                path = synthetic.write(cid, outdir, nturns=nturns * scale, seed=cid)[0]
+            elif scale != 1:
+                path = tile(path, scale, os.path.join(tmpdir, f"{cid}_{scale}x.tsv"))
+            for stage in args.stages:
+                result = measure(STAGES[stage](cid, args.annotator, path), args.repeat)
+                rows.append({
+                    "commit": sha,
+                    "timestamp": timestamp,
+                    "stage": stage,
+                    "scale": scale,
+                    "cid": cid,
+                    "synthetic": args.synthetic,
+                    "repeat": args.repeat,
+                } | result)
+                pd.DataFrame(rows[-1:]).to_json(
+                    args.outpath, orient="records", lines=True, mode="a"
+                )
+                ctx.log.info("%s", rows[-1])
+    ctx.log.info("wrote: %s", args.outpath)
+    # Compare against the previous commit.
+    summary = compare(pd.DataFrame(rows), history)
+    ctx.log.info("results:\n%s", summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    harness(main)
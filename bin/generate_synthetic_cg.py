@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Writes synthetic CG conversations in the raw tsv schema for load testing.
+
+Usage Examples:
+    $ generate_synthetic_cg.py -o path/to/outdir               # One 1000 turn cid.
+    $ generate_synthetic_cg.py -o path/to/outdir -n 10 -t 5000 -a 4
+"""
+from src.core.app import harness
+from src.core.context import Context
+from src.data import synthetic
+
+
+def main(ctx: Context) -> None:
+    ctx.parser.add_argument("-o", "--outdir", required=True)
+    ctx.parser.add_argument("-n", "--nconversations", type=int, default=1)
+    ctx.parser.add_argument("-t", "--nturns", type=int, default=1000)
+    ctx.parser.add_argument("-a", "--nannotators", type=int, default=1)
+    ctx.parser.add_argument("-e", "--max-events", type=int, default=4)
+    ctx.parser.add_argument("-d", "--disagreement", type=float, default=0.1)
+    ctx.parser.add_argument("-s", "--seed", type=int, default=42)
+    args = ctx.parser.parse_args()
+    # Write conversations with synthetic cids.
+    for idx in range(args.nconversations):
+        for path in synthetic.write(
+            90000 + idx,
+            args.outdir,
+            nturns=args.nturns,
+            nannotators=args.nannotators,
+            max_events=args.max_events,
+            disagreement=args.disagreement,
+            seed=args.seed + idx,
+        ):
+            ctx.log.info("wrote: %s", path)
+
+
+if __name__ == "__main__":
+    harness(main)
@@ -5,15 +5,19 @@
 Usage Examples:
     $ generate_yn_questions.py # No args needed.
     $ generate_yn_questions.py --outdir path/to/outdir
+    $ generate_yn_questions.py --context-types end mid
 """
-import itertools
+import functools
 import os
+from typing import Any, Hashable, Iterable, Optional
 
 import pandas as pd
 
+from src.core import artifacts
 from src.core.app import harness
-from src.core.context import Context
+from src.core.context import Context, get_context
 from src.core.path import dirparent
+from src.core.sampling import StratifiedSampler
 from src.data import cg
 
 
@@ -88,82 +92,67 @@ def resolve_3rd_order_yn_answer(qbel, sbel1, sbel2, cg1, cg2):
     return False
 
 
-# XXX: A lot of repeated code here.
-def generate_yn_questions_for_row(df: pd.Series):
-    ret = []
-    qmap = {
-        "CT-": "certainly not",
-        "CT+": "certainly",
-        "PS": "possibly",
+QMAP = {
+    "CT-": "certainly not",
+    "CT+": "certainly",
+    "PS": "possibly",
+}
+PREFIX = "At the time indicated by 🛑, is it the case that"
+# The (order, speakers, question belief) of every question asked per event.
+YN_QUESTIONS = [
+    (order, spkrs, bel)
+    for order, spkrs in (
+        (1, ("A",)), (1, ("B",)),
+        (2, ("A", "B")), (2, ("B", "A")),
+        (3, ("A", "B", "A")), (3, ("B", "A", "B")),
+    )
+    for bel in QMAP
+]
+# Questions per (belief_A, belief_B, cg_A, cg_B) stratum are downsampled to
+# these rates since they dominate the data.
+RATES = {
+    ("CT+", "CT+", "JA", "JA"): 0.1,
+    ("NB", "NB", "NA", "NA"): 0.1,
+}
+
+
+def generate_yn_question(
+    df: pd.Series, order: int, spkrs: tuple[str, ...], bel: str
+) -> dict[str, Any]:
+    if order == 1:
+        answer = resolve_1st_order_yn_answer(bel, df[f"belief_{spkrs[0]}"])
+    else:
+        resolve = {
+            2: resolve_2nd_order_yn_answer, 3: resolve_3rd_order_yn_answer
+        }[order]
+        answer = resolve(
+            bel,
+            df[f"belief_{spkrs[0]}"], df[f"belief_{spkrs[1]}"],
+            df[f"cg_{spkrs[0]}"], df[f"cg_{spkrs[1]}"],
+        )
+    return {
+        "sno": df.sno,
+        "eno": df.eno,
+        "belief_A": df.belief_A,
+        "belief_B": df.belief_B,
+        "belief_Q": bel,
+        "cg_A": df.cg_A,
+        "cg_B": df.cg_B,
+        "order": order,
+        "question": (
+            f"{PREFIX} {' believes that '.join(spkrs)} believes "
+            f"it is {QMAP[bel]} true that {df.event}?"
+        ),
+        "answer": "Yes" if answer else "No",
+        "context_type": df.context_type,
     }
-    prefix = "At the time indicated by 🛑, is it the case that"
-    # First order questions.
-    for spkr, bel in itertools.product(("A", "B"), qmap.keys()):
-        ret.append({
-            "sno": df.sno,
-            "eno": df.eno,
-            "belief_A": df.belief_A,
-            "belief_B": df.belief_B,
-            "belief_Q": bel,
-            "cg_A": df.cg_A,
-            "cg_B": df.cg_B,
-            "order": 1,
-            "question": f"{prefix} {spkr} believes it is {qmap[bel]} true that {df.event}?",
-            "answer": "Yes" if resolve_1st_order_yn_answer(bel, df[f"belief_{spkr}"]) else "No",
-            "context_type": df.context_type,
-        })
-    # Second order questions.
-    for spkrs, bel in itertools.product((("A", "B"), ("B", "A")), qmap.keys()):
-        spkr1, spkr2 = spkrs
-        ret.append({
-            "sno": df.sno,
-            "eno": df.eno,
-            "belief_A": df.belief_A,
-            "belief_B": df.belief_B,
-            "belief_Q": bel,
-            "cg_A": df.cg_A,
-            "cg_B": df.cg_B,
-            "order": 2,
-            "question": (
-                f"{prefix} {spkr1} believes that {spkr2} believes "
-                f"it is {qmap[bel]} true that {df.event}?"
-            ),
-            "answer": "Yes" if resolve_2nd_order_yn_answer(
-                bel,
-                df[f"belief_{spkr1}"], df[f"belief_{spkr2}"],
-                df[f"cg_{spkr1}"], df[f"cg_{spkr2}"],
-            ) else "No",
-            "context_type": df.context_type,
-        })
-    # Third order questions.
-    for spkrs, bel in itertools.product((("A", "B", "A"), ("B", "A", "B")), qmap.keys()):
-        spkr1, spkr2, spkr3 = spkrs
-        ret.append({
-            "sno": df.sno,
-            "eno": df.eno,
-            "belief_A": df.belief_A,
-            "belief_B": df.belief_B,
-            "belief_Q": bel,
-            "cg_A": df.cg_A,
-            "cg_B": df.cg_B,
-            "order": 3,
-            "question": (
-                f"{prefix} {spkr1} believes that {spkr2} believes "
-                f"that {spkr3} believes it is {qmap[bel]} true that {df.event}?"
-            ),
-            "answer": "Yes" if resolve_3rd_order_yn_answer(
-                bel,
-                df[f"belief_{spkr1}"], df[f"belief_{spkr2}"],
-                df[f"cg_{spkr1}"], df[f"cg_{spkr2}"],
-            ) else "No",
-            "context_type": df.context_type,
-        })
-    return pd.DataFrame(ret)
 
 
 # XXX: This is dumb.
-def load_context_for(cid: int, annotator: str, sno: int) -> str:
-    df = cg.load(cid, annotator)[
+def load_context_for(
+    cid: int, annotator: str, sno: int, path: Optional[str] = None
+) -> str:
+    df = cg.load(cid, annotator, path)[
         ["Sno.", "Sentence"]
     ].drop_duplicates().set_index("Sno.")
     df.loc[sno, "Sentence"] = f"{df.loc[sno, 'Sentence']} 🛑"
@@ -171,12 +160,14 @@ def load_context_for(cid: int, annotator: str, sno: int) -> str:
 
 
 # XXX: This is dumb.
-def load_contexts(cid: int, annotator: str) -> pd.DataFrame:
+def load_contexts(
+    cid: int, annotator: str, path: Optional[str] = None
+) -> pd.DataFrame:
     ret = []
-    for sno in sorted(cg.load(cid, annotator)["Sno."].unique()):
+    for sno in sorted(cg.load(cid, annotator, path)["Sno."].unique()):
         ret.append({
             "sno": sno,
-            "context": load_context_for(cid, annotator, sno),
+            "context": load_context_for(cid, annotator, sno, path),
         })
     return pd.DataFrame(ret)
 
@@ -184,61 +175,102 @@ def load_contexts(cid: int, annotator: str) -> pd.DataFrame:
 # Filters speech act events from questions (e.g. A asks ...)
 def filter_out_speech_act_events(df: pd.DataFrame) -> pd.DataFrame:
     assert len(df.cid.unique()) == 1
-    speech_act_enos = []
-    events = df[["eno", "event"]].drop_duplicates()
-    events = events.assign(sno=list(map(int, events.eno)))[["sno", "eno", "event"]]
-    events = events.sort_values("eno")
-    for sno, data in events.groupby("sno"):
-        for left, right in itertools.pairwise(data.to_dict("records")):
-            if not left["event"].endswith(right["event"]):
-                continue
-            pretkns = left["event"].replace(right["event"], "").split(" ")
-            if pretkns[1] in ("asks", "jokes"):
-                speech_act_enos.append(left["eno"])
-            elif pretkns[1] == "said" and pretkns[2] == "that":
-                speech_act_enos.append(left["eno"])
-    return df[~df["eno"].isin(speech_act_enos)]
+    if "speech_act" not in df:
+        df = df.assign(
+            speech_act=df["eno"].isin(cg.EventIndex.from_frame(df).speech_acts)
+        )
+    return df[~df["speech_act"]]
 
 
-def filter_to_interesting_events(df: pd.DataFrame) -> pd.DataFrame:
-    ret = []
-    df = filter_out_speech_act_events(df)
+def filter_to_interesting_events(
+    df: pd.DataFrame, context_types: Iterable[str] = ("end",)
+) -> pd.DataFrame:
+    """
+    Selects the sentences where an event's beliefs change ("end") and the
+    sentences halfway between those changes ("mid").
+
+    Args:
+        df (pd.DataFrame): Events from `cg.load_events`.
+        context_types (Iterable[str]): The context types to keep.
+
+    Returns:
+        The selected rows sorted by (eno, sno) with a context_type column.
+    """
+    df = filter_out_speech_act_events(df).sort_values(["eno", "sno"])
     min_sno, max_sno = df.sno.min(), df.sno.max()
-    for eno, data in df.groupby("eno"):
-        updates = data.drop_duplicates(
-            ["eno", "belief_A", "belief_B"],
-            keep="first"
-        ).sort_values("sno")
-        ends = sorted({min_sno} | set(updates.sno) | {max_sno})
-        mids = list(map(lambda x: (x[0] + x[1]) // 2, itertools.pairwise(ends)))
-        mids = sorted(set(mids) - set(ends))
-        curr = pd.concat([
-            data[data.sno.isin(ends[1:-1])].assign(context_type="end"),
-            data[data.sno.isin(mids)].assign(context_type="mid")
-        ]).sort_values("sno")
-        ret.append(curr[curr.context_type == "end"])
-    return pd.concat(ret)
-
-
-def filter_to_interesting_questions(df: pd.DataFrame) -> pd.DataFrame:
-    ret = []
-    for grp, data in df.groupby(["belief_A", "belief_B", "cg_A", "cg_B"]):
-        if grp == ("CT+", "CT+", "JA", "JA") or grp == ("NB", "NB", "NA", "NA"):
-            ret.append(data.sample(frac=0.1, replace=False, random_state=42))
-        else:
-            ret.append(data)
-    return pd.concat(ret).reset_index(drop=True)
+    # Belief updates are rows that differ from the previous sentence. Beliefs
+    # are missing when only one speaker has any and NaN != NaN.
+    beliefs = df[["eno", "belief_A", "belief_B"]].fillna("")
+    update = beliefs.ne(beliefs.shift()).any(axis=1)
+    end = update & df.sno.gt(min_sno) & df.sno.lt(max_sno)
+    # Midpoints between consecutive boundaries (including the first and last
+    # sentence) that aren't boundaries themselves.
+    enos = df[["eno"]].drop_duplicates()
+    edges = pd.concat([
+        df.loc[end, ["eno", "sno"]],
+        enos.assign(sno=min_sno),
+        enos.assign(sno=max_sno),
+    ]).drop_duplicates().sort_values(["eno", "sno"])
+    nxt = edges.sno.shift(-1).where(edges.eno.eq(edges.eno.shift(-1)))
+    mids = edges.assign(sno=(edges.sno + nxt) // 2)[nxt.notna()]
+    keys = pd.MultiIndex.from_frame(df[["eno", "sno"]])
+    mid = (
+        keys.isin(pd.MultiIndex.from_frame(mids.astype({"sno": int})))
+        & ~keys.isin(pd.MultiIndex.from_frame(edges))
+    )
+    context_type = pd.Series("", index=df.index).mask(end, "end").mask(mid, "mid")
+    return df.assign(context_type=context_type)[
+        context_type.isin(list(context_types))
+    ]
+
+
+def generate_yn_questions(
+    cid: int,
+    annotator: str,
+    path: Optional[str] = None,
+    context_types: Iterable[str] = ("end",),
+    rates: Optional[dict[Hashable, float]] = None,
+    counts: Optional[dict[Hashable, int]] = None,
+) -> pd.DataFrame:
+    """
+    Generates questions for the interesting events of a conversation while
+    sampling them per (belief_A, belief_B, cg_A, cg_B) stratum. Events with
+    a missing label in their stratum aren't asked about.
 
+    Args:
+        cid (int): The conversation id.
+        annotator (str): The annotator.
+        path (Optional[str]): A tsv to read in place of the one for cid.
+        context_types (Iterable[str]): The context types to ask about.
+        rates (Optional[dict[Hashable, float]]): Sampling rates per stratum
+            (defaults to RATES).
+        counts (Optional[dict[Hashable, int]]): Sample sizes per stratum.
 
-def generate_yn_questions(cid: int, annotator: str) -> pd.DataFrame:
-    ret = []
-    events = filter_to_interesting_events(cg.load_events(cid, annotator))
-    for _, row in events.iterrows():
-        ret.append(generate_yn_questions_for_row(row))
-    return filter_to_interesting_questions(
-        pd.concat(ret).assign(cid=cid, annotator=annotator).merge(
-            load_contexts(cid, annotator), how="left", on="sno"
-        )
+    Returns:
+        The sampled questions with their contexts.
+    """
+    ctx = get_context()
+    sampler = StratifiedSampler(RATES if rates is None else rates, counts)
+    with ctx.timer(f"load_events[{cid}]"):
+        events = cg.load_events(cid, annotator, path)
+    with ctx.timer(f"filter_to_interesting_events[{cid}]"):
+        events = filter_to_interesting_events(events, context_types)
+    with ctx.timer(f"sample_questions[{cid}]"):
+        for _, row in events.iterrows():
+            stratum = (row.belief_A, row.belief_B, row.cg_A, row.cg_B)
+            # Skip events a speaker hasn't annotated (as grouping by stratum did).
+            if any(pd.isna(label) for label in stratum):
+                continue
+            for spec in YN_QUESTIONS:
+                sampler.offer(
+                    stratum,
+                    (cid, annotator, row.sno, row.eno, *spec),
+                    functools.partial(generate_yn_question, row, *spec),
+                )
+    with ctx.timer(f"load_contexts[{cid}]"):
+        contexts = load_contexts(cid, annotator, path)
+    return pd.DataFrame(sampler.items()).assign(cid=cid, annotator=annotator).merge(
+        contexts, how="left", on="sno"
     )
 
 
@@ -248,14 +280,26 @@ def main(ctx: Context) -> None:
     )
     ctx.parser.add_argument("-o", "--outdir", default=default_outdir)
     ctx.parser.add_argument("-a", "--annotator", default="Magda")
+    ctx.parser.add_argument(
+        "-f", "--format", choices=("csv.gz", "csv.zst", "parquet"), default="csv.gz"
+    )
+    ctx.parser.add_argument(
+        "-c", "--context-types", nargs="+", choices=("end", "mid"), default=["end"]
+    )
     args = ctx.parser.parse_args()
+    # Fail before generating anything if the format's package is missing.
+    artifacts.check_format(f".{args.format}")
     # Generate questions.
     qs = []
     os.makedirs(args.outdir, exist_ok=True)
     for cid in cg.CIDS:
-        (q := generate_yn_questions(cid, args.annotator)).to_csv(outpath := os.path.join(
-            args.outdir, f"{cid}_{args.annotator}_yn_questions.csv.gz"
-        ), index=False, compression="gzip")
+        with ctx.timer(f"generate_yn_questions[{cid}]"):
+            q = generate_yn_questions(
+                cid, args.annotator, context_types=args.context_types
+            )
+        artifacts.write(q, outpath := os.path.join(
+            args.outdir, f"{cid}_{args.annotator}_yn_questions.{args.format}"
+        ))
         qs.append(q)
         ctx.log.info("wrote: %s", outpath)
     qs = pd.concat(qs).reset_index(drop=True)
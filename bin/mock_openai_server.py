@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Serves a mock OpenAI compatible chat completions API for testing clients.
+
+Every API key gets its own per-minute request budget, which is reported in
+x-ratelimit-* headers like the real API, and requests over budget get a 429.
+
+Usage Examples:
+    $ mock_openai_server.py --port 8089 --rpm 600
+    $ openai_zero_shot.py --base-url http://127.0.0.1:8089/v1 --keys A B
+"""
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from src.core.app import harness
+from src.core.context import Context
+
+
+class Budgets:
+    """Fixed one minute windows of requests per API key."""
+
+    def __init__(self, rpm: int) -> None:
+        self.rpm = rpm
+        self.lock = threading.Lock()
+        self.windows: dict[str, tuple[float, int]] = {}
+
+    def spend(self, key: str) -> tuple[bool, int, float]:
+        """
+        Returns whether the request is allowed, the remaining budget and the
+        seconds until it resets.
+        """
+        with self.lock:
+            now = time.monotonic()
+            start, used = self.windows.get(key, (now, 0))
+            if now - start >= 60:
+                start, used = now, 0
+            allowed = used < self.rpm
+            self.windows[key] = (start, used + allowed)
+            return allowed, self.rpm - used - allowed, 60 - (now - start)
+
+
+def completion(request: dict[str, Any]) -> dict[str, Any]:
+    answer = random.choice(["Yes", "No"])
+    choice: dict[str, Any] = {
+        "index": 0,
+        "message": {"role": "assistant", "content": answer},
+        "finish_reason": "length" if request.get("max_tokens") == 1 else "stop",
+        "logprobs": None,
+    }
+    if request.get("logprobs"):
+        p_yes = random.random()
+        top = [("Yes", p_yes), ("No", 1 - p_yes)][: request.get("top_logprobs", 2)]
+        choice["logprobs"] = {"content": [{
+            "token": answer,
+            "logprob": 0.0,
+            "bytes": None,
+            "top_logprobs": [
+                {"token": tok, "logprob": math.log(max(p, 1e-12)), "bytes": None}
+                for tok, p in top
+            ],
+        }]}
+    prompt_tokens = sum(
+        len(str(msg.get("content", "")).split()) for msg in request["messages"]
+    )
+    return {
+        "id": f"chatcmpl-mock{random.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request["model"],
+        "choices": [choice],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": 1,
+            "total_tokens": prompt_tokens + 1,
+        },
+    }
+
+
+def handler(budgets: Budgets, latency: float) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive.
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def reply(self, status: int, body: dict[str, Any], **headers: str) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name.replace("_", "-"), value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self) -> None:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if not self.path.endswith("/chat/completions"):
+                return self.reply(404, {"error": {"message": "not found"}})
+            key = self.headers.get("Authorization", "").removeprefix("Bearer ")
+            allowed, remaining, reset = budgets.spend(key)
+            headers = {
+                "x_ratelimit_limit_requests": str(budgets.rpm),
+                "x_ratelimit_remaining_requests": str(remaining),
+                "x_ratelimit_reset_requests": f"{reset:.3f}s",
+            }
+            if not allowed:
+                return self.reply(429, {"error": {
+                    "message": "Rate limit reached", "type": "requests"
+                }}, retry_after=f"{reset:.0f}", **headers)
+            time.sleep(random.uniform(0, 2 * latency))
+            self.reply(200, completion(request), **headers)
+
+    return Handler
+
+
+class Server(ThreadingHTTPServer):
+    # The default listen backlog of 5 resets connections when a client opens
+    # many at once.
+    request_queue_size = 256
+
+
+def main(ctx: Context) -> None:
+    ctx.parser.add_argument("-p", "--port", type=int, default=8089)
+    ctx.parser.add_argument("-r", "--rpm", type=int, default=600)
+    ctx.parser.add_argument("-l", "--latency", type=float, default=0.05)
+    args = ctx.parser.parse_args()
+    server = Server(
+        ("127.0.0.1", args.port), handler(Budgets(args.rpm), args.latency)
+    )
+    ctx.log.info("serving on http://127.0.0.1:%d/v1", args.port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    harness(main)
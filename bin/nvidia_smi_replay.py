@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replays a recorded `nvidia-smi --format=csv,nounits --loop-ms` stream so the
+`nvidia.Sampler` can run without a GPU. Other nvidia-smi arguments are
+ignored.
+
+Usage Examples:
+    $ nvidia_smi_replay.py --loop-ms=100
+    $ nvidia_smi_replay.py --loop-ms=100 --recording=path/to/recording.csv
+    >>> Sampler(interval_ms=100, executable=nvidia.REPLAY)
+"""
+import itertools
+import time
+
+from src.core.app import harness
+from src.core.context import Context
+from src.core.nvidia import RECORDING
+
+
+def main(ctx: Context) -> None:
+    ctx.parser.add_argument("--loop-ms", type=int, default=1000)
+    ctx.parser.add_argument("--recording", default=RECORDING)
+    ctx.parser.add_argument("--repeat", action="store_true", help="loop forever")
+    args, _ = ctx.parser.parse_known_args()
+    with open(args.recording, "r") as fd:
+        header, *rows = fd.read().splitlines()
+    print(header, flush=True)
+    # Samples taken at the same time are emitted together, one loop apart.
+    samples = [
+        list(grp) for _, grp in itertools.groupby(rows, lambda row: row.split(",")[0])
+    ]
+    for sample in itertools.cycle(samples) if args.repeat else samples:
+        print("\n".join(sample), flush=True)
+        time.sleep(args.loop_ms / 1000)
+
+
+if __name__ == "__main__":
+    harness(main)
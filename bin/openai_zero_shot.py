@@ -7,14 +7,17 @@ Usage Examples:
     $ openai_zero_shot.py                   # No args needed.
     $ openai_zero_shot.py -o path/to/outdir # Custom outdir.
     $ openai_zero_shot.py --model gpt-4 --temperature 0.75
+    $ openai_zero_shot.py --budget 1024 --dryrun  # Project tokens and cost.
+    $ openai_zero_shot.py --logprobs --temperature 0  # Score P(Yes)/P(No).
+    $ openai_zero_shot.py --keys IACS IACS-2          # Shard across keys.
 """
 import asyncio
 import datetime
 import hashlib
+import math
 import operator
 import os
-import time
-from typing import Any
+from typing import Any, Iterable, Optional
 
 import backoff
 import openai
@@ -25,33 +28,106 @@ from tqdm import tqdm
 from src.core.app import harness
 from src.core.context import Context
 from src.core.path import dirparent
-from src.core import keychain
+from src.core import artifacts, clients
 from src.data import prompts, questions
 
 
 TEMPLATE = prompts.load("gpt-zero-shot")
+# Answers are "Yes" or "No" but chat models sometimes add punctuation.
+COMPLETION_TOKENS = 2
+# Alternatives returned per token when scoring (the API allows up to 20).
+TOP_LOGPROBS = 10
 
 
-def load_questions(window_size: int = 5) -> pd.DataFrame:
+def window_questions(
+    qs: pd.DataFrame,
+    window_size: int = 5,
+    builder: Optional[prompts.PromptBuilder] = None,
+) -> pd.DataFrame:
+    """
+    Cuts the context of questions to window_size sentences on either side of
+    🛑, or to the window that fits the builder's budget.
+    """
     def fn(row: pd.Series) -> pd.Series:
         ctx = row.context.split("\n")
-        start, end = max(0, row.sno - 1 - window_size), row.sno + window_size
-        assert len(ctx[start:end]) <= (window_size * 2) + 1
         assert ctx[row.sno - 1].endswith("🛑")
+        if builder:
+            start, end = builder.window(ctx, row.sno - 1, row.question)
+        else:
+            start, end = max(0, row.sno - 1 - window_size), row.sno + window_size
+        assert len(ctx[start:end]) <= (window_size * 2) + 1 or builder
         row.context = "\n".join(ctx[start:end])
         return row
-    return questions.load().apply(fn, axis=1)
+    return qs.apply(fn, axis=1)
+
+
+def load_questions(
+    window_size: int = 5, builder: Optional[prompts.PromptBuilder] = None
+) -> pd.DataFrame:
+    return window_questions(questions.load(), window_size, builder)
+
+
+def estimate(
+    qs: pd.DataFrame,
+    model_name: str,
+    builder: prompts.PromptBuilder,
+    logprobs: bool = False,
+) -> dict[str, float]:
+    """Projects the tokens and cost of running the model on the questions."""
+    return prompts.estimate([
+        builder.count(context, question)
+        for context, question in zip(qs.context, qs.question)
+    ], model_name, 1 if logprobs else COMPLETION_TOKENS)
+
+
+def answer_probs(top_logprobs: list[tuple[str, float]]) -> dict[str, float]:
+    """
+    Sums the probability of every candidate first token that normalizes to
+    Yes or No (e.g. "Yes", " yes", "YES").
+
+        >>> answer_probs([("Yes", -0.01), (" yes", -6.2), ("No", -4.8)])
+        <<< {"p_yes": 0.992, "p_no": 0.008, "p_yes_norm": 0.992}
+    """
+    probs = {"yes": 0.0, "no": 0.0}
+    for token, logprob in top_logprobs:
+        if (key := token.strip(" .!,\n").lower()) in probs:
+            probs[key] += math.exp(logprob)
+    total = probs["yes"] + probs["no"]
+    return {
+        "p_yes": probs["yes"],
+        "p_no": probs["no"],
+        # P(Yes) renormalized over the two answers (NaN if neither is listed).
+        "p_yes_norm": probs["yes"] / total if total else math.nan,
+    }
+
+
+# Transient errors retried on top of rate limits. The pool turns off the SDK's
+# own retries so every retry can pick another key.
+TRANSIENT = (
+    openai.APIConnectionError,  # Includes APITimeoutError.
+    openai.InternalServerError,
+)
 
 
 @backoff.on_exception(backoff.expo, openai.RateLimitError)
+@backoff.on_exception(backoff.expo, TRANSIENT, max_tries=8)
 async def get_completion(
-    client: openai.AsyncOpenAI,
+    client: clients.ClientPool,
     question: pd.Series,
     model_name: str,
-    temperature: float = 1.0
+    temperature: float = 1.0,
+    logprobs: bool = False,
 ) -> dict[str, Any]:
+    """
+    Asks the model a question. With logprobs only the first token is
+    generated and the probabilities of answering Yes and No are recorded
+    alongside it (see `answer_probs`).
+    """
     prompt = TEMPLATE.format(context=question.context, question=question.question)
-    result = await client.chat.completions.create(
+    kwargs: dict[str, Any] = {}
+    if logprobs:
+        kwargs = {"max_tokens": 1, "logprobs": True, "top_logprobs": TOP_LOGPROBS}
+    result = await client.create(
         messages=[
             {
                 "role": "user",
@@ -60,9 +136,10 @@ async def get_completion(
         ],
         model=model_name,
         temperature=temperature,
+        **kwargs,
     )
     assert len(result.choices) == 1
-    return question.to_dict() | {
+    ret = question.to_dict() | {
         "prompt_template": TEMPLATE,
         "prompt": prompt,
         "temperature": temperature,
@@ -70,20 +147,55 @@ async def get_completion(
         "timestamp": datetime.datetime.now(),
         "generation": result.choices[0].message.content,
     }
+    if logprobs:
+        # Some models and servers return no logprobs (or no tokens at all).
+        content = getattr(result.choices[0].logprobs, "content", None)
+        if content:
+            ret |= answer_probs(
+                [(lp.token, lp.logprob) for lp in content[0].top_logprobs]
+            )
+        else:
+            ret |= dict.fromkeys(("p_yes", "p_no", "p_yes_norm"), math.nan)
+    return ret
 
 
 async def get_completions(
-    model_name: str, temperature: float = 1.0
+    client: clients.ClientPool,
+    qs: pd.DataFrame,
+    model_name: str,
+    temperature: float = 1.0,
+    logprobs: bool = False,
 ) -> list[dict[str, Any]]:
     ret = []
-    client = openai.AsyncOpenAI()
-    qs = map(operator.itemgetter(1), load_questions().iterrows())
-    tasks = [get_completion(client, q, model_name, temperature) for q in qs]
+    qs = map(operator.itemgetter(1), qs.iterrows())
+    tasks = [
+        get_completion(client, q, model_name, temperature, logprobs) for q in qs
+    ]
     for chunk in tqdm(list(chunked(tasks, n=60))):
         ret += await asyncio.gather(*chunk)
-        # Trying to respect rate limits.
-        time.sleep((60 / 5000) * len(chunk) * 10)
-    return ret 
+        # Trying to respect rate limits (which are per key).
+        await asyncio.sleep((60 / 5000) * len(chunk) * 10 / len(client))
+    return ret
+
+
+async def run(
+    qs: pd.DataFrame,
+    model_name: str,
+    temperature: float = 1.0,
+    logprobs: bool = False,
+    keys: Iterable[str] = ("IACS",),
+    organizations: Optional[Iterable[Optional[str]]] = None,
+    base_url: Optional[str] = None,
+) -> tuple[list[dict[str, Any]], pd.DataFrame]:
+    """
+    Gets completions using a pool of API keys (see `clients.ClientPool`).
+
+    Returns:
+        The completions and the per key stats of the pool.
+    """
+    async with clients.ClientPool(keys, organizations, base_url) as client:
+        ret = await get_completions(client, qs, model_name, temperature, logprobs)
+    return ret, client.stats()
 
 
 def main(ctx: Context) -> None:
@@ -93,19 +205,61 @@ def main(ctx: Context) -> None:
     ctx.parser.add_argument("-o", "--outdir", default=default_outdir)
     ctx.parser.add_argument("-m", "--model", default="gpt-3.5-turbo")
     ctx.parser.add_argument("-t", "--temperature", type=float, default=1.0)
+    ctx.parser.add_argument("-w", "--window-size", type=int, default=5)
+    ctx.parser.add_argument(
+        "-b", "--budget", type=int, help="fit context windows to this many tokens"
+    )
+    ctx.parser.add_argument(
+        "-n", "--dryrun", action="store_true", help="only report projected cost"
+    )
+    ctx.parser.add_argument(
+        "-l", "--logprobs", action="store_true", help="score P(Yes)/P(No) in 1 token"
+    )
+    ctx.parser.add_argument(
+        "-k", "--keys", nargs="+", default=["IACS"], help="keychain entries to use"
+    )
+    ctx.parser.add_argument(
+        "--organizations", nargs="+", help="an organization per key ('' for none)"
+    )
+    ctx.parser.add_argument("--base-url", help="e.g. a mock_openai_server.py url")
     args = ctx.parser.parse_args()
+    if args.organizations:
+        args.organizations = [org or None for org in args.organizations]
+    # Build contexts and project their cost.
+    builder = prompts.PromptBuilder(
+        TEMPLATE,
+        budget=args.budget or 0,
+        count=prompts.tokenizer(args.model),
+        max_size=None if args.budget else args.window_size,
+    )
+    with ctx.timer("load_questions"):
+        qs = load_questions(args.window_size, builder if args.budget else None)
+    projected = estimate(qs, args.model, builder, args.logprobs)
+    ctx.log.info("projected usage: %s", projected)
+    if args.dryrun:
+        return
     # Generate dialogues asynchronously.
-    os.environ["OPENAI_API_KEY"] = keychain.get("IACS")
-    completions = pd.DataFrame(asyncio.run(get_completions(args.model, args.temperature)))
+    with ctx.timer("get_completions"):
+        completions, stats = asyncio.run(run(
+            qs,
+            args.model,
+            args.temperature,
+            args.logprobs,
+            args.keys,
+            args.organizations,
+            args.base_url,
+        ))
+        completions = pd.DataFrame(completions)
+    ctx.log.info("key stats:\n%s", stats.to_string(index=False))
     # Write generations to file.
     model_name = completions.iloc[0]["model_name"]
     phash = hashlib.shake_256(TEMPLATE.encode("utf-8")).hexdigest(8)
+    mode = "_logprobs" if args.logprobs else ""
     outname = datetime.datetime.now().strftime(
-        f"{model_name}_{phash}_%Y%m%d.%H%M%S.csv.gz"
+        f"{model_name}_{phash}{mode}_%Y%m%d.%H%M%S.csv.gz"
     )
     outpath = os.path.join(args.outdir, outname)
-    os.makedirs(args.outdir, exist_ok=True)
-    completions.to_csv(outpath, index=False, compression="gzip")
+    artifacts.write(completions, outpath)
     ctx.log.info("wrote: %s", outpath)
 
 
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs the TSV -> questions -> completions -> scores pipeline incrementally.
+
+Only stale shards (one per CID) are rebuilt. Completions reuse the previous
+generations of any prompt that is unchanged so only new prompts are sent.
+
+Usage Examples:
+    $ run_pipeline.py --dryrun                 # Show what is stale.
+    $ run_pipeline.py --targets questions      # Just regenerate questions.
+    $ run_pipeline.py --model gpt-4 --budget 1024
+"""
+import functools
+import os
+import re
+from glob import glob
+from typing import Any, Optional
+
+import pandas as pd
+from more_itertools import one
+
+from src.core import artifacts
+from src.core.app import harness
+from src.core.context import Context
+from src.core.path import dirparent
+from src.core.pipeline import Pipeline, Shard, Stage
+from src.data import cg, prompts
+
+
+DATA_DIR = os.path.join(dirparent(os.path.realpath(__file__), 2), "data")
+MANIFEST = os.path.join(DATA_DIR, "pipeline", "manifest.json")
+# Columns `openai_zero_shot.get_completion` adds to a question.
+GENERATION_COLUMNS = [
+    "prompt_template", "temperature", "model_name", "timestamp", "generation"
+]
+LOGPROB_COLUMNS = ["p_yes", "p_no", "p_yes_norm"]
+TEMPLATE_PATH = os.path.join(prompts.PROMPT_DIR, "gpt-zero-shot")
+
+
+def question_shards(args: Any) -> list[Shard]:
+    return [
+        Shard(
+            str(cid),
+            [one(glob(os.path.join(cg.CG_DIR, f"{cid}*{args.annotator}*.tsv")))],
+            os.path.join(
+                args.outdir, "questions", f"{cid}_{args.annotator}_yn_questions.csv.gz"
+            ),
+            {"annotator": args.annotator, "context_types": args.context_types},
+        )
+        for cid in cg.CIDS
+    ]
+
+
+def write_questions(shard: Shard) -> None:
+    from generate_yn_questions import generate_yn_questions
+
+    cid, annotator = int(shard.key), shard.params["annotator"]
+    artifacts.write(generate_yn_questions(
+        cid, annotator, one(shard.inputs), shard.params["context_types"]
+    ), shard.output)
+
+
+def run_name(args: Any) -> str:
+    return f"{args.model}_logprobs" if args.logprobs else args.model
+
+
+def completion_shards(args: Any) -> list[Shard]:
+    return [
+        Shard(
+            shard.key,
+            [shard.output, TEMPLATE_PATH],
+            os.path.join(
+                args.outdir, "completions", f"{shard.key}_{run_name(args)}.csv.gz"
+            ),
+            {
+                "model": args.model,
+                "temperature": args.temperature,
+                "window_size": args.window_size,
+                "budget": args.budget,
+                "logprobs": args.logprobs,
+            },
+        )
+        for shard in question_shards(args)
+    ]
+
+
+def write_completions(
+    ctx: Context,
+    shard: Shard,
+    keys: list[str],
+    organizations: Optional[list[Optional[str]]] = None,
+    base_url: Optional[str] = None,
+) -> None:
+    import asyncio
+
+    import openai_zero_shot as zs
+
+    params = shard.params
+    # Shard inputs are sorted so the questions are whichever isn't the prompt.
+    questions = one(path for path in shard.inputs if path != TEMPLATE_PATH)
+    builder = prompts.PromptBuilder(
+        zs.TEMPLATE, params["budget"] or 0, prompts.tokenizer(params["model"])
+    )
+    qs = zs.window_questions(
+        artifacts.read(questions),
+        params["window_size"],
+        builder if params["budget"] else None,
+    )
+    qs = qs.assign(prompt=[
+        zs.TEMPLATE.format(context=context, question=question)
+        for context, question in zip(qs.context, qs.question)
+    ])
+    # Reuse generations for prompts that haven't changed.
+    done = pd.DataFrame()
+    if os.path.exists(shard.output):
+        done = artifacts.read(shard.output)
+        done = done[
+            done.prompt.isin(set(qs.prompt))
+            & done.temperature.eq(params["temperature"])
+            & done.model_name.str.startswith(params["model"])
+        ]
+    todo = qs[~qs.prompt.isin(set(done.get("prompt", ())))].drop_duplicates(
+        "prompt"
+    ).drop(columns="prompt")
+    ctx.log.info(
+        "completions[%s]: %d reused, %d to query", shard.key, len(done), len(todo)
+    )
+    new = pd.DataFrame()
+    if len(todo):
+        completions, stats = asyncio.run(zs.run(
+            todo,
+            params["model"],
+            params["temperature"],
+            params["logprobs"],
+            keys,
+            organizations,
+            base_url,
+        ))
+        new = pd.DataFrame(completions)
+        ctx.log.info("key stats:\n%s", stats.to_string(index=False))
+    # Attach generations to the current questions by prompt.
+    columns = GENERATION_COLUMNS + (LOGPROB_COLUMNS if params["logprobs"] else [])
+    generations = pd.concat([done, new], ignore_index=True)[
+        ["prompt", *columns]
+    ].drop_duplicates("prompt")
+    artifacts.write(
+        qs.merge(generations, how="left", on="prompt", validate="m:1"),
+        shard.output,
+    )
+
+
+def score_shards(args: Any) -> list[Shard]:
+    return [
+        Shard(
+            shard.key,
+            [shard.output],
+            os.path.join(args.outdir, "scores", f"{shard.key}_{run_name(args)}.csv"),
+        )
+        for shard in completion_shards(args)
+    ]
+
+
+def normalize(generation: Any) -> str:
+    """
+        >>> normalize(" Yes.")
+        <<< "Yes"
+    """
+    words = re.findall(r"[a-z]+", str(generation).lower())
+    return words[0].capitalize() if words else ""
+
+
+def write_scores(shard: Shard) -> None:
+    df = artifacts.read(one(shard.inputs))
+    df = df.assign(correct=df.generation.map(normalize).eq(df.answer))
+    aggs = {"accuracy": ("correct", "mean"), "n": ("correct", "size")}
+    if "p_yes_norm" in df:
+        # Scored runs also get the Brier score of P(Yes) against the answer.
+        df = df.assign(brier=(df.p_yes_norm - df.answer.eq("Yes")) ** 2)
+        aggs["brier"] = ("brier", "mean")
+    ret = pd.concat([
+        df.groupby(["cid", "order", "context_type"]).agg(**aggs),
+        df.groupby(["cid"]).agg(**aggs).assign(
+            order="all", context_type="all"
+        ).set_index(["order", "context_type"], append=True),
+    ]).reset_index()
+    artifacts.write(ret, shard.output)
+
+
+def main(ctx: Context) -> None:
+    ctx.parser.add_argument("-o", "--outdir", default=os.path.dirname(MANIFEST))
+    ctx.parser.add_argument("-a", "--annotator", default="Magda")
+    ctx.parser.add_argument(
+        "-c", "--context-types", nargs="+", choices=("end", "mid"), default=["end"]
+    )
+    ctx.parser.add_argument("-m", "--model", default="gpt-3.5-turbo")
+    ctx.parser.add_argument("-t", "--temperature", type=float, default=1.0)
+    ctx.parser.add_argument("-w", "--window-size", type=int, default=5)
+    ctx.parser.add_argument("-b", "--budget", type=int)
+    ctx.parser.add_argument("-l", "--logprobs", action="store_true")
+    ctx.parser.add_argument("-k", "--keys", nargs="+", default=["IACS"])
+    ctx.parser.add_argument("--organizations", nargs="+")
+    ctx.parser.add_argument("--base-url")
+    ctx.parser.add_argument(
+        "--targets", nargs="+", choices=("questions", "completions", "scores")
+    )
+    ctx.parser.add_argument("-f", "--force", action="store_true")
+    ctx.parser.add_argument("-n", "--dryrun", action="store_true")
+    args = ctx.parser.parse_args()
+    if args.organizations:
+        args.organizations = [org or None for org in args.organizations]
+    pipeline = Pipeline([
+        Stage(
+            "questions",
+            functools.partial(question_shards, args),
+            write_questions,
+        ),
+        Stage(
+            "completions",
+            functools.partial(completion_shards, args),
+            functools.partial(
+                write_completions,
+                ctx,
+                keys=args.keys,
+                organizations=args.organizations,
+                base_url=args.base_url,
+            ),
+            deps=["questions"],
+        ),
+        Stage(
+            "scores",
+            functools.partial(score_shards, args),
+            write_scores,
+            deps=["completions"],
+        ),
+    ], os.path.join(args.outdir, os.path.basename(MANIFEST)))
+    with ctx.timer("pipeline"):
+        results = pipeline.run(args.targets, args.force, args.dryrun)
+    ctx.log.info("results:\n%s", pd.DataFrame(
+        results, columns=["stage", "shard", "status"]
+    ).to_string(index=False))
+
+
+if __name__ == "__main__":
+    harness(main)
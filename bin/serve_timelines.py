@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Serves point-in-time belief state queries from one warm timeline index.
+
+Endpoints (GET, JSON):
+    /state?cid=4245&annotator=Magda&eno=1.1&sno=40
+    /snapshot?cid=4245&annotator=Magda&sno=40
+    /changes?cid=4245&annotator=Magda&eno=1.1
+    /summary
+
+Usage Examples:
+    $ serve_timelines.py              # No args needed.
+    $ serve_timelines.py --port 8090
+"""
+import json
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+import pandas as pd
+
+from src.core.app import harness
+from src.core.context import Context
+from src.data.timeline import TimelineIndex
+
+
+def records(df: pd.DataFrame) -> list[dict[str, Any]]:
+    return json.loads(df.to_json(orient="records"))
+
+
+def handler(index: TimelineIndex) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive.
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def reply(self, status: int, body: Any) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            url = urllib.parse.urlparse(self.path)
+            params = dict(urllib.parse.parse_qsl(url.query))
+            try:
+                if url.path == "/summary":
+                    return self.reply(200, records(index.summary()))
+                timeline = index[(int(params["cid"]), params["annotator"])]
+                if url.path == "/state":
+                    body = timeline.state(float(params["eno"]), int(params["sno"]))
+                elif url.path == "/snapshot":
+                    body = records(timeline.snapshot(int(params["sno"])))
+                elif url.path == "/changes":
+                    body = records(timeline.changes(float(params["eno"])))
+                else:
+                    return self.reply(404, {"error": f"unknown path: {url.path}"})
+            except KeyError as exc:
+                return self.reply(404, {"error": f"not found: {exc}"})
+            except ValueError as exc:
+                return self.reply(400, {"error": str(exc)})
+            self.reply(200, body)
+
+    return Handler
+
+
+def main(ctx: Context) -> None:
+    ctx.parser.add_argument("-p", "--port", type=int, default=8090)
+    args = ctx.parser.parse_args()
+    with ctx.timer("build"):
+        index = TimelineIndex.build()
+    ctx.log.info("index:\n%s", index.summary().to_string(index=False))
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler(index))
+    ctx.log.info("serving on http://127.0.0.1:%d", args.port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    harness(main)
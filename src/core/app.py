@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*
 import argparse
+import cProfile
+import io
 import logging
 import os
+import pstats
 import subprocess
 import sys
-from typing import Any, Callable
+import tracemalloc
+from typing import Any, Callable, Optional
 
 from .context import Context, get_context
 from .slurm import sbatch
@@ -54,16 +58,47 @@ def slurmify(parser: argparse.ArgumentParser) -> argparse.Namespace:
     return args
 
 
+def _dump_profile(ctx: Context, profiler: cProfile.Profile, top: int = 25) -> None:
+    profiler.dump_stats(path := ctx.artifact(".prof"))
+    ctx.log.info("wrote: %s", path)
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+    ctx.log.info("hotspots:\n%s", stream.getvalue())
+
+
+def _dump_tracemalloc(ctx: Context, top: int = 25) -> None:
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    snapshot.dump(path := ctx.artifact(".tracemalloc"))
+    ctx.log.info("wrote: %s", path)
+    stats = snapshot.statistics("lineno")[:top]
+    ctx.log.info(
+        "memory [current %.1f MiB, peak %.1f MiB]:\n%s",
+        current / 2**20,
+        peak / 2**20,
+        "\n".join(map(str, stats)),
+    )
+
+
 def harness(main: Callable[[Context], Any]) -> int:
     # Create a context.
     ctx = get_context()
+    profiler: Optional[cProfile.Profile] = None
+    if ctx.profile and ctx.logpath:
+        profiler = cProfile.Profile()
+    if ctx.trace_memory and ctx.logpath:
+        tracemalloc.start()
 
     # Run main.
     ctx.log.debug("Prelude complete.")
     ctx.log.info("Starting main.")
     exit_status = None
     try:
-        main(ctx)
+        if profiler:
+            profiler.runcall(main, ctx)
+        else:
+            main(ctx)
     except (Exception, KeyboardInterrupt) as exc:
         ctx.log.error(exc, exc_info=True)
         exit_status = 1
@@ -73,6 +108,12 @@ def harness(main: Callable[[Context], Any]) -> int:
         exit_status = 0
 
     # Epilogue
+    if profiler:
+        _dump_profile(ctx, profiler)
+    if tracemalloc.is_tracing():
+        _dump_tracemalloc(ctx)
+    if path := ctx.write_timings():
+        ctx.log.info("wrote: %s", path)
     ctx.log.info(f"Main complete. [exit {exit_status}]")
     ctx.log.debug("Epilogue complete.")
     return exit_status
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import datetime
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import subprocess
+from typing import Any, Optional
+
+import pandas as pd
+
+from .path import atomic
+
+
+MANIFEST = ".manifest.json"
+FORMATS = (".parquet", ".csv.zst", ".csv.gz", ".csv")
+# Optional packages (the `artifacts` extra) some formats need.
+REQUIRES = {".parquet": "pyarrow", ".csv.zst": "zstandard"}
+THREADS = os.cpu_count() or 1
+
+
+def manifest_path(path: str) -> str:
+    return path + MANIFEST
+
+
+def checksum(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as fd:
+        while chunk := fd.read(2**20):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def check_format(path: str) -> None:
+    """
+    Raises before any work is done if a path's format is unknown or needs a
+    package that isn't installed.
+
+        >>> check_format("questions.parquet")
+        <<< ImportError: .parquet needs pyarrow (pip install pyarrow)
+    """
+    if not (suffix := next((sfx for sfx in FORMATS if path.endswith(sfx)), None)):
+        raise ValueError(f"unknown format (expected one of {FORMATS}): {path}")
+    if (pkg := REQUIRES.get(suffix)) and importlib.util.find_spec(pkg) is None:
+        raise ImportError(f"{suffix} needs {pkg} (pip install {pkg})")
+
+
+def _to_csv_gz(df: pd.DataFrame, path: str, threads: int, **kwargs: Any) -> None:
+    # NOTE: The gzip header stores no filename (path is a temp file) and a zero
+    #       mtime so the same data always has the same checksum.
+    with open(path, "wb") as fd:
+        # Use parallel gzip when it's installed.
+        if threads > 1 and (pigz := shutil.which("pigz")):
+            proc = subprocess.Popen(
+                [pigz, "-c", "-n", "-p", str(threads)],
+                stdin=subprocess.PIPE,
+                stdout=fd,
+            )
+            assert proc.stdin
+            with io.TextIOWrapper(proc.stdin, encoding="utf-8", newline="") as stream:
+                df.to_csv(stream, **kwargs)
+            if proc.wait():
+                raise subprocess.CalledProcessError(proc.returncode, pigz)
+            return
+        with gzip.GzipFile(filename="", mode="wb", fileobj=fd, mtime=0) as gz:
+            with io.TextIOWrapper(gz, encoding="utf-8", newline="") as stream:
+                df.to_csv(stream, **kwargs)
+
+
+def write(
+    df: pd.DataFrame, path: str, threads: int = THREADS, index: bool = False
+) -> dict[str, Any]:
+    """
+    Atomically writes a DataFrame with a sidecar manifest
+    (`{path}.manifest.json`) recording its row count and checksum.
+
+    The format comes from the suffix: .parquet (zstd via pyarrow), .csv.zst
+    (multi-threaded zstd, needs zstandard), .csv.gz (parallel with pigz if
+    installed) or .csv.
+
+    Args:
+        df (pd.DataFrame): The data to write.
+        path (str): Where to write it.
+        threads (int): The number of compression threads.
+        index (bool): Whether to write the index.
+
+    Returns:
+        The manifest.
+    """
+    with atomic(path) as tmp:
+        if path.endswith(".parquet"):
+            df.to_parquet(tmp, index=index, compression="zstd")
+        elif path.endswith(".csv.zst"):
+            compression = {"method": "zstd", "threads": threads}
+            df.to_csv(tmp, index=index, compression=compression)
+        elif path.endswith(".csv.gz"):
+            _to_csv_gz(df, tmp, threads, index=index)
+        elif path.endswith(".csv"):
+            df.to_csv(tmp, index=index)
+        else:
+            raise ValueError(f"unknown format (expected one of {FORMATS}): {path}")
+        manifest = {
+            "path": os.path.basename(path),
+            "rows": len(df),
+            "columns": list(map(str, df.columns)),
+            "sha256": checksum(tmp),
+            "created": datetime.datetime.now().isoformat(),
+        }
+    # The data is in place before its manifest so an interrupted write leaves
+    # a stale manifest that fails validation rather than unchecked data.
+    with atomic(manifest_path(path)) as tmp:
+        with open(tmp, "w") as fd:
+            json.dump(manifest, fd, indent=2)
+    return manifest
+
+
+def read(path: str, validate: bool = True, **kwargs: Any) -> pd.DataFrame:
+    """
+    Reads a file written by `write`, checking it against its manifest.
+
+    Files without a manifest (e.g. written before manifests existed) are read
+    without validation.
+
+    Args:
+        path (str): The file to read.
+        validate (bool): Whether to check the checksum and row count.
+        **kwargs: Passed to `pd.read_parquet` or `pd.read_csv`.
+
+    Raises:
+        ValueError: If the file doesn't match its manifest.
+    """
+    manifest: Optional[dict[str, Any]] = None
+    if validate and os.path.exists(manifest_path(path)):
+        with open(manifest_path(path), "r") as fd:
+            manifest = json.load(fd)
+        if checksum(path) != manifest["sha256"]:
+            raise ValueError(f"checksum does not match manifest: {path}")
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path, **kwargs)
+    else:
+        df = pd.read_csv(path, **kwargs)
+    # Row counts only hold when the reader isn't filtering.
+    if manifest and not kwargs and len(df) != manifest["rows"]:
+        raise ValueError(f"expected {manifest['rows']} rows, read {len(df)}: {path}")
+    return df
+
+
+def is_artifact(path: str) -> bool:
+    """Whether a path is data (rather than a manifest or temp file)."""
+    name = os.path.basename(path)
+    return not name.startswith(".") and name.endswith(FORMATS)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import re
+import time
+from typing import Any, Iterable, Optional
+
+import httpx
+import openai
+import pandas as pd
+
+from . import keychain
+
+
+DURATION = re.compile(r"(?:(\d+)h)?(?:(\d+)m(?!s))?(?:([\d.]+)s)?(?:(\d+)ms)?")
+
+
+def seconds(duration: Optional[str]) -> float:
+    """
+    Parses the durations OpenAI uses in rate limit headers.
+
+        >>> seconds("6m0s"), seconds("1.5s"), seconds("120ms")
+        <<< (360.0, 1.5, 0.12)
+    """
+    if not duration:
+        return 0.0
+    if (match := DURATION.fullmatch(duration.strip())) is None:
+        return float(duration)
+    hours, minutes, secs, millis = (float(grp or 0) for grp in match.groups())
+    return hours * 3600 + minutes * 60 + secs + millis / 1000
+
+
+class Key:
+    """One API key (and organization) with its rate limit budget and stats."""
+
+    def __init__(
+        self, name: str, client: openai.AsyncOpenAI, organization: Optional[str]
+    ) -> None:
+        self.name = name
+        self.client = client
+        self.organization = organization
+        # Budgets are unknown (unlimited) until the first response.
+        self.remaining_requests = float("inf")
+        self.remaining_tokens = float("inf")
+        self.reset_at = 0.0
+        self.cooldown_until = 0.0
+        self.inflight = 0
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "seconds": 0.0,
+        }
+
+    def budget(self, now: float) -> tuple[float, float]:
+        """The requests and tokens the key can still spend before its reset."""
+        if now >= self.reset_at:
+            return float("inf"), float("inf")
+        return self.remaining_requests - self.inflight, self.remaining_tokens
+
+    def update(self, headers: httpx.Headers, now: float) -> None:
+        if "x-ratelimit-remaining-requests" in headers:
+            self.remaining_requests = float(headers["x-ratelimit-remaining-requests"])
+        if "x-ratelimit-remaining-tokens" in headers:
+            self.remaining_tokens = float(headers["x-ratelimit-remaining-tokens"])
+        self.reset_at = now + max(
+            seconds(headers.get("x-ratelimit-reset-requests")),
+            seconds(headers.get("x-ratelimit-reset-tokens")),
+        )
+
+
+class ClientPool:
+    """
+    Spreads chat completions across several API keys that share one
+    keep-alive HTTP connection pool.
+
+    Each request goes to the key with the most remaining requests (then
+    tokens) according to the rate limit headers of its last response, less
+    the requests it already has in flight. A key that is rate limited cools
+    down for its retry-after period and its RateLimitError is raised so the
+    caller can retry (e.g. with backoff), which lands on another key. The
+    SDK's own retries are off for the same reason, so callers should also
+    retry connection errors, timeouts and 5xx responses.
+
+    Examples:
+        >>> async with ClientPool(["IACS", "IACS-2"], [None, "org-x"]) as pool:
+                result = await pool.create(model="gpt-4", messages=[...])
+        >>> pool.stats()
+    """
+
+    def __init__(
+        self,
+        keys: Iterable[str],
+        organizations: Optional[Iterable[Optional[str]]] = None,
+        base_url: Optional[str] = None,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        timeout: float = 60.0,
+    ) -> None:
+        """
+        Args:
+            keys (Iterable[str]): Keychain entries holding the API keys.
+            organizations (Optional[Iterable[Optional[str]]]): An organization
+                per key (None for the key's default).
+            base_url (Optional[str]): An OpenAI compatible server (e.g. a
+                local mock) in place of the API.
+            max_connections (int): The limit on open connections.
+            max_keepalive_connections (int): Idle connections kept for reuse.
+            timeout (float): The read timeout of a request in seconds.
+        """
+        keys = list(keys)
+        organizations = list(organizations or [None] * len(keys))
+        assert keys and len(keys) == len(organizations)
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=30.0,
+            ),
+            timeout=httpx.Timeout(timeout, connect=10.0),
+        )
+        self.keys = [
+            Key(name, openai.AsyncOpenAI(
+                api_key=keychain.get(name),
+                organization=org,
+                base_url=base_url,
+                http_client=self.http,
+                # Retries are left to the caller so they can switch keys.
+                max_retries=0,
+            ), org)
+            for name, org in zip(keys, organizations)
+        ]
+        self.started = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    async def _pick(self) -> Key:
+        while True:
+            now = time.monotonic()
+            ready = [key for key in self.keys if key.cooldown_until <= now]
+            if not ready:
+                await asyncio.sleep(min(k.cooldown_until for k in self.keys) - now)
+                continue
+            # Ties (e.g. before any budget is known) go to the least busy key.
+            return max(ready, key=lambda key: (*key.budget(now), -key.inflight))
+
+    async def create(self, **kwargs: Any) -> Any:
+        """Calls `chat.completions.create` with the key that has most budget."""
+        key = await self._pick()
+        key.inflight += 1
+        start = time.monotonic()
+        try:
+            raw = await key.client.chat.completions.with_raw_response.create(**kwargs)
+        except openai.RateLimitError as exc:
+            key.stats["rate_limited"] += 1
+            now = time.monotonic()
+            key.update(exc.response.headers, now)
+            retry = seconds(exc.response.headers.get("retry-after")) or 1.0
+            key.cooldown_until = max(key.cooldown_until, now + retry)
+            raise
+        except Exception:
+            key.stats["errors"] += 1
+            raise
+        finally:
+            key.inflight -= 1
+            key.stats["requests"] += 1
+            key.stats["seconds"] += time.monotonic() - start
+        key.update(raw.headers, time.monotonic())
+        result = raw.parse()
+        if result.usage:
+            key.stats["prompt_tokens"] += result.usage.prompt_tokens
+            key.stats["completion_tokens"] += result.usage.completion_tokens
+        return result
+
+    def stats(self) -> pd.DataFrame:
+        """Per key request, error and token counts with throughput."""
+        ret = pd.DataFrame([
+            {"key": key.name, "organization": key.organization} | key.stats
+            for key in self.keys
+        ])
+        elapsed = time.monotonic() - self.started
+        ret["requests_per_second"] = ret.requests / elapsed
+        ret["mean_latency"] = ret.seconds / ret.requests.where(ret.requests > 0)
+        return ret
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+    async def __aenter__(self) -> "ClientPool":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.aclose()
@@ -1,13 +1,16 @@
 # -*- coding: utf-8 -*-
+import contextlib
 import getpass
 import inspect
+import json
 import logging.handlers
 import os
+import resource
 import sys
 import time
 from argparse import ArgumentParser
 from types import ModuleType
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
 
 
 # TODO: This belongs somewhere else?
@@ -31,6 +34,16 @@ class Context:
         self.parser.add_argument(
             "-v", "--verbose", action="store_true", help="turn on verbose logging"
         )
+        self.parser.add_argument(
+            "--profile", action="store_true", help="run main under cProfile"
+        )
+        self.parser.add_argument(
+            "--trace-memory", action="store_true", help="run main under tracemalloc"
+        )
+        self.profile = "--profile" in sys.argv
+        self.trace_memory = "--trace-memory" in sys.argv
+        self.timings: list[dict[str, Any]] = []
+        self.logpath: Optional[str] = None
         if any(flg in sys.argv for flg in ("-h", "--help")):
             return  # Don't intialize logging if we are just printing help.
         # Intialize logging.
@@ -46,6 +59,7 @@ class Context:
             level=logging.INFO,
             handlers=[logging.StreamHandler(), logging.FileHandler(logpath)],
         )
+        self.logpath = logpath
         self.log.info("Initialized logging: %s", logpath)
         # Handle default arguments.
         if any(flg in sys.argv for flg in ("-v", "--verbose")):
@@ -57,6 +71,50 @@ class Context:
         module = inspect.getmodule(frame[0])
         return logging.getLogger(module.__name__ if module else frame.filename)
 
+    def artifact(self, suffix: str) -> str:
+        """Returns a path next to the log file with the given suffix."""
+        assert self.logpath
+        return self.logpath[: -len(".log")] + suffix
+
+    @contextlib.contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """
+        Records the wall time of a stage and how much it raised the process's
+        peak RSS.
+
+        Note:
+            ru_maxrss is a lifetime high-water mark so a stage that stays under
+            an earlier stage's peak has a delta of 0 and the same
+            process_peak_rss_mib.
+
+        Examples:
+            >>> with ctx.timer("load"):
+                    df = cg.load_events(cid, annotator)
+        """
+        start = time.perf_counter()
+        # NOTE: ru_maxrss is in KiB on linux.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        try:
+            yield
+        finally:
+            end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            self.timings.append(
+                {
+                    "stage": stage,
+                    "seconds": time.perf_counter() - start,
+                    "peak_rss_delta_mib": end - peak,
+                    "process_peak_rss_mib": end,
+                }
+            )
+            logging.getLogger(__name__).info("timer: %s", self.timings[-1])
+
+    def write_timings(self) -> Optional[str]:
+        if not self.timings or not self.logpath:
+            return None
+        with open(path := self.artifact(".timings.json"), "w") as fd:
+            json.dump(self.timings, fd, indent=2)
+        return path
+
 
 _CONTEXT = None
 
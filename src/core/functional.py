@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-from typing import Any, Callable, Iterable, Iterator, TypeVar, Union
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar, Union
+import contextlib
+import operator
 import os
 import shelve
 
+from .path import atomic
+
 
 def safe_iter(arg: Union[Any, Iterable[Any]]) -> Iterable[Any]:
     """
@@ -26,7 +30,8 @@ def safe_iter(arg: Union[Any, Iterable[Any]]) -> Iterable[Any]:
 
 def save_iter(itr: Iterable[Any], path: str, mode: str = "w") -> None:
     """
-    Writes an iterator line by line to the given file path.
+    Writes an iterator line by line to the given file path. Unless appending,
+    the file is replaced atomically once the iterator is exhausted.
 
     Args:
         itr (Iterator[Any]): An iterator to be stringified and saved.
@@ -55,16 +60,58 @@ def save_iter(itr: Iterable[Any], path: str, mode: str = "w") -> None:
             We too have our drugs.
     """
     os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
-    with open(path, mode, encoding="utf-8") as fd:
-        for first in itr:
-            fd.write(str(first))
-            for line in itr:
-                fd.write("\n" + str(line))
+    # Appends can't be atomic but overwrites are written to a temp file first.
+    with contextlib.ExitStack() as stack:
+        if "a" not in mode:
+            path = stack.enter_context(atomic(path))
+        with open(path, mode, encoding="utf-8") as fd:
+            for first in itr:
+                fd.write(str(first))
+                for line in itr:
+                    fd.write("\n" + str(line))
+
+
+_OPS: dict[str, Callable[[Any, Any], Any]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda val, vals: val in vals,
+    "not in": lambda val, vals: val not in vals,
+}
+_NEGATED = {
+    "==": "!=", "!=": "==", "<": ">=", ">=": "<", ">": "<=", "<=": ">",
+    "in": "not in", "not in": "in",
+}
 
 
 class Filter:
-    def __init__(self, fn: Callable[..., bool]):
+    """
+    A predicate that composes with `&`, `|` and `~` into an expression tree.
+
+    Calling a filter evaluates it item by item. Filters built from `Column`
+    comparisons can also be compiled to a vectorized mask over a DataFrame
+    (or a dict of arrays) with `mask`, or to DNF filters for columnar readers
+    (e.g. `pd.read_parquet(filters=...)`) with `pushdown`. Any other predicate
+    in the tree falls back to being called once per row.
+
+    Examples:
+        >>> flt = (Column("order") > 1) & ~Column("answer").isin(["No"])
+        >>> flt
+        <<< Filter(((order > 1) & ~(answer in ('No',))))
+        >>> df[flt.mask(df)]
+        >>> flt.pushdown()
+        <<< [[('order', '>', 1), ('answer', 'not in', ('No',))]]
+    """
+
+    def __init__(
+        self, fn: Callable[..., bool], op: str = "fn", args: tuple[Any, ...] = ()
+    ):
         self.fn = fn
+        self.op = op
+        self.args = args
 
     def __call__(self, *args: Any, **kwargs: Any) -> bool:
         return self.fn(*args, **kwargs)
@@ -73,16 +120,163 @@ class Filter:
         def fn(*args: Any, **kwargs: Any) -> bool:
             return self(*args, **kwargs) and other(*args, **kwargs)
 
-        return Filter(fn)
+        return Filter(fn, "and", (self, other))
 
     def __or__(self, other: Filter) -> Filter:
         def fn(*args: Any, **kwargs: Any) -> bool:
             return self(*args, **kwargs) or other(*args, **kwargs)
 
-        return Filter(fn)
+        return Filter(fn, "or", (self, other))
 
     def __invert__(self) -> Filter:
-        return Filter(lambda *args, **kwargs: not self.fn(*args, **kwargs))
+        def fn(*args: Any, **kwargs: Any) -> bool:
+            return not self(*args, **kwargs)
+
+        return Filter(fn, "not", (self,))
+
+    def __repr__(self) -> str:
+        return f"Filter({self._expr()})"
+
+    def _expr(self) -> str:
+        if self.op == "cmp":
+            name, op, value = self.args
+            return f"({name} {op} {value!r})"
+        if self.op in ("and", "or"):
+            sym = "&" if self.op == "and" else "|"
+            return f"({self.args[0]._expr()} {sym} {self.args[1]._expr()})"
+        if self.op == "not":
+            return f"~{self.args[0]._expr()}"
+        return getattr(self.fn, "__name__", repr(self.fn))
+
+    def mask(self, data: Any) -> Any:
+        """
+        Evaluates the filter over whole columns at once.
+
+        Args:
+            data: A DataFrame or a mapping from column names to arrays. A
+                mapping is converted to a DataFrame if the tree has a
+                predicate that has to be called per row.
+
+        Returns:
+            A boolean Series (or array) with one value per row.
+        """
+        if self.op == "cmp":
+            name, op, value = self.args
+            values = data[name]
+            if op in ("in", "not in"):
+                if hasattr(values, "isin"):
+                    ret = values.isin(list(value))
+                else:
+                    import numpy as np
+
+                    ret = np.isin(values, list(value))
+                return ~ret if op == "not in" else ret
+            return _OPS[op](values, value)
+        if self.op == "and":
+            return self.args[0].mask(data) & self.args[1].mask(data)
+        if self.op == "or":
+            return self.args[0].mask(data) | self.args[1].mask(data)
+        if self.op == "not":
+            return ~self.args[0].mask(data)
+        # Fall back to calling the predicate on each row.
+        import pandas as pd
+
+        if not isinstance(data, pd.DataFrame):
+            data = pd.DataFrame(data)
+        return data.apply(self.fn, axis=1).astype(bool)
+
+    def negate(self) -> Filter:
+        """
+        Returns an equivalent of `~self` with negations pushed to the leaves.
+
+        Range comparisons are flipped (e.g. `~(x < 1)` becomes `x >= 1`), so
+        this is only equivalent for rows without missing values: a NaN fails
+        both `x < 1` and `x >= 1`.
+        """
+        if self.op == "cmp":
+            name, op, value = self.args
+            return _compare(name, _NEGATED[op], value)
+        if self.op == "and":
+            return self.args[0].negate() | self.args[1].negate()
+        if self.op == "or":
+            return self.args[0].negate() & self.args[1].negate()
+        if self.op == "not":
+            return self.args[0]
+        return ~self
+
+    def pushdown(self) -> Optional[list[list[tuple[str, str, Any]]]]:
+        """
+        Compiles the filter to disjunctive normal form as a list of
+        conjunctions of (column, op, value) tuples.
+
+        Negations are pushed into the comparisons with `negate`, so rows where
+        a negated range comparison sees a missing value are excluded by the
+        pushdown filter while `mask` and calling the filter keep them (e.g.
+        `~(Column("x") < 1)` keeps x=NaN but `[[("x", ">=", 1)]]` doesn't).
+        Drop or fill missing values first if that matters.
+
+        Returns:
+            The DNF filters or None if the tree has a predicate that isn't a
+            column comparison.
+        """
+        if self.op == "cmp":
+            return [[self.args]]
+        if self.op == "not":
+            inner = self.args[0]
+            return None if inner.op == "fn" else inner.negate().pushdown()
+        if self.op in ("and", "or"):
+            left, right = self.args[0].pushdown(), self.args[1].pushdown()
+            if left is None or right is None:
+                return None
+            if self.op == "or":
+                return left + right
+            return [lconj + rconj for lconj in left for rconj in right]
+        return None
+
+
+def _compare(name: str, op: str, value: Any) -> Filter:
+    if op in ("in", "not in"):
+        value = tuple(value)
+
+    def fn(row: Any) -> bool:
+        return bool(_OPS[op](row[name], value))
+
+    return Filter(fn, "cmp", (name, op, value))
+
+
+class Column:
+    """
+    Builds `Filter`s that compare a column (or key) of each row to a value.
+
+    Examples:
+        >>> flt = (Column("belief_A") == "CT+") | (Column("order") >= 2)
+        >>> flt({"belief_A": "NB", "order": 3})
+        <<< True
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __eq__(self, value: Any) -> Filter:  # type: ignore[override]
+        return _compare(self.name, "==", value)
+
+    def __ne__(self, value: Any) -> Filter:  # type: ignore[override]
+        return _compare(self.name, "!=", value)
+
+    def __lt__(self, value: Any) -> Filter:
+        return _compare(self.name, "<", value)
+
+    def __le__(self, value: Any) -> Filter:
+        return _compare(self.name, "<=", value)
+
+    def __gt__(self, value: Any) -> Filter:
+        return _compare(self.name, ">", value)
+
+    def __ge__(self, value: Any) -> Filter:
+        return _compare(self.name, ">=", value)
+
+    def isin(self, values: Iterable[Any]) -> Filter:
+        return _compare(self.name, "in", values)
 
 
 def shelf(path: str) -> Any:
@@ -1,11 +1,54 @@
 # -*- coding: utf-8 -*-
+from __future__ import annotations
+import collections
+import contextlib
+import fcntl
 import io
+import json
+import os
 import re
 import subprocess
-from typing import Any
+import tempfile
+import threading
+import time
+from types import TracebackType
+from typing import Any, Iterable, Optional
 
 import pandas as pd
 
+from .path import dirparent
+
+
+PROPS = (
+    "timestamp",
+    "index",
+    "gpu_name",
+    "temperature.gpu",
+    "utilization.gpu",
+    "utilization.memory",
+    "memory.total",
+    "memory.free",
+    "memory.used",
+)
+# A recorded stream and a script that replays it in place of nvidia-smi.
+RECORDING = os.path.join(
+    dirparent(os.path.realpath(__file__), 3), "data", "nvidia", "nvidia-smi.csv"
+)
+REPLAY = os.path.join(
+    dirparent(os.path.realpath(__file__), 3), "bin", "nvidia_smi_replay.py"
+)
+
+
+def _number(val: str) -> Optional[int]:
+    """
+    Parses a numeric field, treating values like [N/A] or [Not Supported]
+    that some GPUs report as missing.
+    """
+    try:
+        return int(val)
+    except ValueError:
+        return None
+
 
 def query_gpu_props() -> list[str]:
     ret = []
@@ -24,35 +67,318 @@ def query_gpu_props() -> list[str]:
     return ret
 
 
+def parse_csv(text: str) -> pd.DataFrame:
+    """
+    Parses `nvidia-smi --format=csv` output (with or without units).
+
+    Args:
+        text (str): The csv output including the header line.
+
+    Returns:
+        A DataFrame with MiB and % columns converted to nullable integers
+        (missing for [N/A] and [Not Supported]).
+    """
+    df = pd.read_csv(io.StringIO(text), skipinitialspace=True)
+    df.columns = pd.Index([cname.strip() for cname in df.columns])
+    for col in df.columns:
+        if "MiB" in col or "%" in col:
+            df[col] = pd.to_numeric(
+                df[col].astype(str).str.rstrip(" MiB%").str.strip(), errors="coerce"
+            ).astype("Int64")
+    return df
+
+
 def query_gpu() -> pd.DataFrame:
-    props = [
-        "timestamp",
-        "index",
-        "gpu_name",
-        "temperature.gpu",
-        "utilization.gpu",
-        "utilization.memory",
-        "memory.total",
-        "memory.free",
-        "memory.used",
-    ]
-    cmd = ["nvidia-smi", f"--query-gpu={','.join(props)}", "--format=csv"]
+    cmd = ["nvidia-smi", f"--query-gpu={','.join(PROPS)}", "--format=csv"]
     cproc = subprocess.run(cmd, capture_output=True, check=True)
+    return parse_csv(cproc.stdout.decode("utf-8"))
 
-    def process(row: "pd.Series[Any]") -> "pd.Series[Any]":
-        for idx in row.index:
-            if "MiB" in idx:
-                row[idx] = int(row[idx].replace("MiB", "").strip())
-            if "%" in idx:
-                row[idx] = int(row[idx].replace("%", "").strip())
-        return row
 
-    df = pd.read_csv(io.StringIO(cproc.stdout.decode("utf-8")))
-    df.columns = pd.Index([cname.strip() for cname in df.columns])
-    return df.apply(process, axis=1)
+def _best(df: pd.DataFrame) -> int:
+    return int(df.sort_values("memory.free [MiB]", ascending=False).iloc[0]["index"])
 
 
 def best_gpu() -> int:
-    return int(
-        query_gpu().sort_values("memory.free [MiB]", ascending=False).iloc[0]["index"]
-    )
+    return _best(query_gpu())
+
+
+LOCK_DIR = os.path.join(tempfile.gettempdir(), "nvidia-reservations")
+# Seconds a reservation is held for, long enough for a worker to allocate its
+# memory, after which `query_gpu` already accounts for it.
+TTL = 300.0
+
+
+def pack(df: pd.DataFrame, needs: list[int]) -> list[int]:
+    """
+    Bin-packs workers onto GPUs, largest first, each onto the device with the
+    most remaining free memory.
+
+    Args:
+        df (pd.DataFrame): A `query_gpu` frame (only `index` and
+            `memory.free [MiB]` are used). GPUs that report no free memory
+            (e.g. [N/A]) are skipped.
+        needs (list[int]): The memory each worker needs in MiB.
+
+    Returns:
+        The GPU index assigned to each worker, in the order of `needs`.
+
+    Examples:
+        >>> df = pd.DataFrame({"index": [0, 1], "memory.free [MiB]": [1000, 800]})
+        >>> pack(df, [600, 500, 300])
+        <<< [0, 1, 0]
+    """
+    df = df.dropna(subset=["memory.free [MiB]"])
+    if df.empty:
+        raise ValueError("no GPU reports its free memory")
+    free = dict(zip(df["index"].astype(int), df["memory.free [MiB]"].astype(int)))
+    ret = [-1] * len(needs)
+    for wid in sorted(range(len(needs)), key=lambda wid: -needs[wid]):
+        gpu = max(free, key=lambda idx: (free[idx], -idx))
+        if free[gpu] < needs[wid]:
+            raise ValueError(f"cannot fit worker {wid} ({needs[wid]} MiB)")
+        free[gpu] -= needs[wid]
+        ret[wid] = gpu
+    return ret
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextlib.contextmanager
+def _reservations(lockdir: str) -> Any:
+    os.makedirs(lockdir, exist_ok=True)
+    path = os.path.join(lockdir, "reservations.json")
+    with open(os.path.join(lockdir, "reservations.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            rsvs = []
+            if os.path.exists(path):
+                with open(path, "r") as fd:
+                    rsvs = json.load(fd)
+            now = time.time()
+            rsvs = [
+                rsv for rsv in rsvs
+                if _alive(rsv["pid"]) and rsv.get("expires", now) >= now
+            ]
+            yield rsvs
+            with open(tmp := f"{path}.{os.getpid()}", "w") as fd:
+                json.dump(rsvs, fd)
+            os.replace(tmp, path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def reserve(
+    needs: list[int],
+    df: Optional[pd.DataFrame] = None,
+    lockdir: str = LOCK_DIR,
+    pid: Optional[int] = None,
+    ttl: float = TTL,
+) -> list[int]:
+    """
+    Places workers with `pack` while holding a node-wide file lock so that
+    concurrent launches account for each other's reservations.
+
+    Reservations are held until the owning process exits, `release` is
+    called or `ttl` seconds pass. Once a worker has allocated its memory the
+    free memory reported by nvidia-smi already reflects it, so call
+    `release` after workers start (or let the TTL expire) to avoid counting
+    it twice.
+
+    Args:
+        needs (list[int]): The memory each worker needs in MiB.
+        df (Optional[pd.DataFrame]): A `query_gpu` frame. Queried if not given.
+        lockdir (str): Where the lock and reservation files are kept.
+        pid (Optional[int]): The owning process. Defaults to this process.
+        ttl (float): Seconds until the reservations expire.
+
+    Returns:
+        The GPU index assigned to each worker, in the order of `needs`.
+    """
+    pid = pid or os.getpid()
+    with _reservations(lockdir) as rsvs:
+        df = (query_gpu() if df is None else df).copy()
+        for rsv in rsvs:
+            df.loc[df["index"] == rsv["gpu"], "memory.free [MiB]"] -= rsv["mib"]
+        ret = pack(df, needs)
+        expires = time.time() + ttl
+        rsvs += [
+            {"pid": pid, "gpu": gpu, "mib": mib, "expires": expires}
+            for gpu, mib in zip(ret, needs)
+        ]
+    return ret
+
+
+def release(lockdir: str = LOCK_DIR, pid: Optional[int] = None) -> None:
+    pid = pid or os.getpid()
+    with _reservations(lockdir) as rsvs:
+        rsvs[:] = [rsv for rsv in rsvs if rsv["pid"] != pid]
+
+
+def environ(gpu: int) -> dict[str, str]:
+    """Returns a copy of `os.environ` with `CUDA_VISIBLE_DEVICES` set to `gpu`."""
+    return dict(os.environ, CUDA_VISIBLE_DEVICES=str(gpu))
+
+
+class Sampler:
+    """
+    Keeps a single `nvidia-smi --loop-ms` process open and parses its output
+    incrementally into a per-GPU ring buffer on a background thread.
+
+    Examples:
+        >>> with Sampler(interval_ms=500, window=120) as sampler:
+                sampler.wait()
+                sampler.stats()
+                sampler.best_gpu()
+
+    Note:
+        Pass `executable=REPLAY` to replay a recorded `nvidia-smi` stream
+        (RECORDING) on machines without a GPU.
+    """
+
+    def __init__(
+        self,
+        interval_ms: int = 1000,
+        window: int = 60,
+        executable: str = "nvidia-smi",
+    ) -> None:
+        self.interval_ms = interval_ms
+        self.window = window
+        self.executable = executable
+        self.columns: list[str] = []
+        self.buffers: dict[int, collections.deque[list[Any]]] = {}
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._proc: Optional[subprocess.Popen[str]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def cmd(self) -> list[str]:
+        return [
+            self.executable,
+            f"--query-gpu={','.join(PROPS)}",
+            "--format=csv,nounits",
+            f"--loop-ms={self.interval_ms}",
+        ]
+
+    def start(self) -> Sampler:
+        self._proc = subprocess.Popen(
+            self.cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+        )
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._proc and self._proc.poll() is None:
+            self._proc.terminate()
+            self._proc.wait()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> Sampler:
+        return self.start()
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        assert self._proc and self._proc.stdout
+        try:
+            self.feed(self._proc.stdout)
+        except BaseException as exc:
+            self.error = exc
+            raise
+
+    @property
+    def alive(self) -> bool:
+        """Whether samples are still being collected."""
+        return bool(self._thread and self._thread.is_alive())
+
+    def feed(self, lines: Iterable[str]) -> None:
+        """
+        Parses `nvidia-smi` csv lines into the ring buffers.
+
+        Args:
+            lines (Iterable[str]): Raw output lines. Header lines may repeat.
+        """
+        for line in lines:
+            fields = [field.strip() for field in line.split(",")]
+            if not fields or not fields[0]:
+                continue
+            if fields[0] == "timestamp":
+                self.columns = fields
+                continue
+            row: list[Any] = []
+            for col, val in zip(self.columns, fields):
+                row.append(_number(val) if "MiB" in col or "%" in col else val)
+            idx = int(row[self.columns.index("index")])
+            with self._lock:
+                if idx not in self.buffers:
+                    self.buffers[idx] = collections.deque(maxlen=self.window)
+                self.buffers[idx].append(row)
+            self._ready.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until at least one sample has been parsed."""
+        return self._ready.wait(timeout)
+
+    def _frame(self, rows: list[list[Any]]) -> pd.DataFrame:
+        return pd.DataFrame(rows, columns=self.columns).astype({
+            "index": int,
+            **{
+                col: "Int64" for col in self.columns if "MiB" in col or "%" in col
+            },
+        })
+
+    def history(self) -> pd.DataFrame:
+        """Returns every buffered sample in the same format as `query_gpu`."""
+        with self._lock:
+            rows = [row for buf in self.buffers.values() for row in buf]
+        return self._frame(rows)
+
+    def snapshot(self) -> pd.DataFrame:
+        """Returns the latest sample per GPU in the same format as `query_gpu`."""
+        with self._lock:
+            rows = [buf[-1] for buf in self.buffers.values() if buf]
+        return self._frame(rows)
+
+    def stats(self) -> pd.DataFrame:
+        """Returns rolling mean/max utilization and memory per GPU."""
+        cols = [col for col in self.columns if "MiB" in col or "%" in col]
+        return self.history().groupby("index")[cols].agg(["mean", "max"])
+
+    def best_gpu(self) -> int:
+        """
+        Returns the GPU with the most free memory in the latest samples.
+
+        Raises:
+            RuntimeError: If nothing was sampled yet or sampling has stopped
+                (nvidia-smi exited or its output couldn't be parsed) since the
+                samples would be stale.
+        """
+        if not self.wait(timeout=0):
+            raise RuntimeError("no gpu samples have been collected yet")
+        if not self.alive:
+            returncode = self._proc.poll() if self._proc else None
+            raise RuntimeError(
+                f"gpu sampling stopped [exit {returncode}]: {self.error!r}"
+            )
+        return _best(self.snapshot())
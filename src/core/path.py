@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*
+import contextlib
 import os
+import tempfile
+from typing import Iterator
 
 
 def dirparent(path: str, n: int = 1) -> str:
@@ -20,3 +23,30 @@ def dirparent(path: str, n: int = 1) -> str:
     for _ in range(n):
         path = os.path.dirname(path)
     return path
+
+
+@contextlib.contextmanager
+def atomic(path: str) -> Iterator[str]:
+    """
+    Yields a temporary path next to `path` that is renamed over it only if the
+    block completes, so readers never see a partially written file.
+
+    Examples:
+        >>> with atomic("out.csv.gz") as tmp:
+                df.to_csv(tmp, compression="gzip")
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(
+        dir=dirname, prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        # Match the permissions of a normally created file.
+        os.umask(umask := os.umask(0))
+        os.chmod(tmp, 0o666 & ~umask)
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import datetime
+import graphlib
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Callable, Iterable, Optional
+
+from .artifacts import checksum
+from .path import atomic
+
+
+class Shard:
+    """
+    One unit of work of a stage: the files it reads, the parameters it runs
+    with and the file it writes.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        inputs: Iterable[str],
+        output: str,
+        params: Optional[dict[str, Any]] = None,
+    ) -> None:
+        self.key = key
+        self.inputs = sorted(inputs)
+        self.output = output
+        self.params = dict(params or {})
+
+    def __repr__(self) -> str:
+        return f"Shard({self.key!r}, output={self.output!r})"
+
+
+class Stage:
+    """
+    A step of a pipeline.
+
+    Args:
+        name (str): A unique name.
+        shards (Callable[[], Iterable[Shard]]): Lists the work of the stage.
+            It is called after the stages it depends on have run, so it can
+            glob their outputs.
+        run (Callable[[Shard], Any]): Writes shard.output from shard.inputs.
+        deps (Iterable[str]): The names of the stages it reads from.
+        version (str): Bump to invalidate every shard after a code change.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        shards: Callable[[], Iterable[Shard]],
+        run: Callable[[Shard], Any],
+        deps: Iterable[str] = (),
+        version: str = "1",
+    ) -> None:
+        self.name = name
+        self.shards = shards
+        self.run = run
+        self.deps = tuple(deps)
+        self.version = version
+
+
+class Pipeline:
+    """
+    Runs a DAG of stages, rerunning only the shards whose inputs, parameters
+    or stage version changed since they were last built, or whose output is
+    missing or was modified.
+
+    Each built shard is recorded in a JSON manifest with the content hashes of
+    its inputs and output. Since staleness is decided by content rather than
+    mtimes, a rebuilt shard whose output is byte for byte unchanged doesn't
+    invalidate the shards downstream of it. That only holds if the stage
+    writes deterministically (`artifacts.write` does, but e.g. generations
+    with timestamps never will). File hashes are cached by (size, mtime) so
+    unchanged files are not rehashed.
+
+    Examples:
+        >>> pipeline = Pipeline([
+                Stage("questions", question_shards, write_questions),
+                Stage("scores", score_shards, write_scores, deps=["questions"]),
+            ], "data/.pipeline.json")
+        >>> pipeline.run()
+        <<< [("questions", "4245", "built"), ("scores", "4245", "fresh"), ...]
+    """
+
+    def __init__(self, stages: Iterable[Stage], manifest: str) -> None:
+        self.stages = {stage.name: stage for stage in stages}
+        self.manifest = manifest
+        self.root = os.path.dirname(os.path.abspath(manifest))
+        self.log = logging.getLogger(__name__)
+        self.state: dict[str, Any] = {"files": {}, "shards": {}}
+        if os.path.exists(manifest):
+            with open(manifest, "r") as fd:
+                self.state = json.load(fd)
+
+    def _rel(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def _save(self) -> None:
+        with atomic(self.manifest) as tmp:
+            with open(tmp, "w") as fd:
+                json.dump(self.state, fd, indent=2, sort_keys=True)
+
+    def hash(self, path: str) -> Optional[str]:
+        """Returns the sha256 of a file (or None if missing) using the cache."""
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        cached = self.state["files"].get(rel := self._rel(path))
+        if cached and cached["size"] == stat.st_size and (
+            cached["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return cached["sha256"]
+        self.state["files"][rel] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": (sha := checksum(path)),
+        }
+        return sha
+
+    def fingerprint(self, stage: Stage, shard: Shard) -> str:
+        """Hashes everything that determines a shard's output."""
+        string = json.dumps({
+            "stage": stage.name,
+            "version": stage.version,
+            "params": shard.params,
+            "inputs": {self._rel(path): self.hash(path) for path in shard.inputs},
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(string.encode("utf-8")).hexdigest()
+
+    def stale(self, stage: Stage, shard: Shard) -> Optional[str]:
+        """Returns why a shard needs to be (re)built or None if it is fresh."""
+        if missing := [path for path in shard.inputs if not os.path.exists(path)]:
+            raise FileNotFoundError(f"{stage.name}[{shard.key}] inputs: {missing}")
+        record = self.state["shards"].get(f"{stage.name}/{shard.key}")
+        if record is None:
+            return "new"
+        if (output := self.hash(shard.output)) is None:
+            return "missing output"
+        if output != record["output_sha256"]:
+            return "modified output"
+        if self.fingerprint(stage, shard) != record["fingerprint"]:
+            return "changed inputs"
+        return None
+
+    def order(self, targets: Optional[Iterable[str]] = None) -> list[str]:
+        """Topologically sorts the targets (default: all) and their deps."""
+        graph = {name: stage.deps for name, stage in self.stages.items()}
+        todo, keep = list(targets or graph), set()
+        while todo:
+            if (name := todo.pop()) not in keep:
+                keep.add(name)
+                todo.extend(graph[name])
+        return [name for name in graphlib.TopologicalSorter(graph).static_order()
+                if name in keep]
+
+    def run(
+        self,
+        targets: Optional[Iterable[str]] = None,
+        force: bool = False,
+        dryrun: bool = False,
+    ) -> list[tuple[str, str, str]]:
+        """
+        Builds the stale shards of the target stages and their dependencies.
+
+        Args:
+            targets (Optional[Iterable[str]]): Stage names (default: all).
+            force (bool): Rebuild every shard.
+            dryrun (bool): Only report what is stale. Shards downstream of
+                stale shards are listed as their outputs may not exist yet.
+
+        Returns:
+            The (stage, shard key, status) of every shard.
+        """
+        ret = []
+        for name in self.order(targets):
+            stage = self.stages[name]
+            for shard in stage.shards():
+                try:
+                    reason = "forced" if force else self.stale(stage, shard)
+                except FileNotFoundError:
+                    if not dryrun:
+                        raise
+                    reason = "upstream"
+                if reason is None:
+                    ret.append((name, shard.key, "fresh"))
+                    continue
+                self.log.info("%s[%s] is stale (%s)", name, shard.key, reason)
+                if dryrun:
+                    ret.append((name, shard.key, reason))
+                    continue
+                stage.run(shard)
+                if not os.path.exists(shard.output):
+                    raise RuntimeError(f"{name}[{shard.key}] wrote no output")
+                self.state["shards"][f"{name}/{shard.key}"] = {
+                    "fingerprint": self.fingerprint(stage, shard),
+                    "output": self._rel(shard.output),
+                    "output_sha256": self.hash(shard.output),
+                    "built": datetime.datetime.now().isoformat(),
+                }
+                # Save after every shard so an interrupted run keeps its work.
+                self._save()
+                ret.append((name, shard.key, "built"))
+        if not dryrun:
+            self._save()
+        return ret
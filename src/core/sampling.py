@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import collections
+import hashlib
+import random
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+
+class StratifiedSampler:
+    """
+    Samples a stream of items per stratum without building the ones it skips.
+
+    Strata with a rate keep an item when the hash of its key falls below that
+    rate, so the choice is deterministic and made before the item is built.
+    Strata with a count keep a uniform reservoir of that many items. All other
+    strata keep everything.
+
+    Examples:
+        >>> sampler = StratifiedSampler(rates={"common": 0.1}, counts={"big": 100})
+        >>> for stratum, key in stream:
+                sampler.offer(stratum, key, lambda: expensive(key))
+        >>> sampler.items()
+    """
+
+    def __init__(
+        self,
+        rates: Optional[dict[Hashable, float]] = None,
+        counts: Optional[dict[Hashable, int]] = None,
+        seed: int = 42,
+    ) -> None:
+        self.rates = dict(rates or {})
+        self.counts = dict(counts or {})
+        assert not set(self.rates) & set(self.counts)
+        self.seed = seed
+        self.seen: collections.Counter[Hashable] = collections.Counter()
+        self._rng = random.Random(seed)
+        self._items: dict[Hashable, list[Any]] = collections.defaultdict(list)
+
+    def _unit(self, stratum: Hashable, key: Iterable[Any]) -> float:
+        # NOTE: Keys are joined with str() rather than repr() so numpy scalars
+        #       hash the same as python ones.
+        string = "\x1f".join(map(str, (self.seed, stratum, *key)))
+        digest = hashlib.blake2b(string.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") / 2**64
+
+    def keep(self, stratum: Hashable, key: Iterable[Any]) -> bool:
+        """Whether a rate (or unsampled) stratum keeps the item with this key."""
+        assert stratum not in self.counts
+        if stratum not in self.rates:
+            return True
+        return self._unit(stratum, key) < self.rates[stratum]
+
+    def offer(
+        self, stratum: Hashable, key: Iterable[Any], build: Callable[[], Any]
+    ) -> None:
+        """
+        Offers an item to the sampler, calling build only if it is kept.
+
+        Args:
+            stratum (Hashable): The item's stratum.
+            key (Iterable[Any]): Identifies the item for hash based sampling.
+            build (Callable[[], Any]): Creates the item.
+        """
+        self.seen[stratum] += 1
+        if stratum not in self.counts:
+            if self.keep(stratum, key):
+                self._items[stratum].append(build())
+            return
+        items, count = self._items[stratum], self.counts[stratum]
+        if len(items) < count:
+            items.append(build())
+        elif (idx := self._rng.randrange(self.seen[stratum])) < count:
+            items[idx] = build()
+
+    def items(self) -> list[Any]:
+        return [item for items in self._items.values() for item in items]
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*
+import itertools
+import os
+from glob import glob
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from . import cg
+
+
+LABELS = {
+    "belief": cg.BELIEFS,
+    "cg": cg.CG_UPDATES,
+}
+# Labels for an event before it is annotated (see `cg.load_events`).
+DEFAULTS = {
+    "belief": "NB",
+    "cg": "NA",
+}
+
+
+def available(cid: int) -> list[str]:
+    """Returns the annotators with an annotation file for the cid."""
+    return [
+        annotator for annotator in cg.ANNOTATORS
+        if glob(os.path.join(cg.CG_DIR, f"{cid}*{annotator}*.tsv"))
+    ]
+
+
+def load_states(
+    cid: int,
+    annotators: Optional[list[str]] = None,
+    paths: Optional[dict[str, str]] = None,
+) -> pd.DataFrame:
+    """
+    Loads the cumulative belief states of every annotator for a cid.
+
+    Events only one annotator labeled are treated as unannotated (NB/NA) for
+    the others.
+
+    Args:
+        cid (int): The conversation id.
+        annotators (Optional[list[str]]): Defaults to all available.
+        paths (Optional[dict[str, str]]): Tsvs to read by annotator in place
+            of the ones in CG_DIR (e.g. from `synthetic.write`).
+
+    Returns:
+        A frame indexed by (sno, eno, speaker) with (annotator, family) columns.
+    """
+    paths = paths or {}
+    annotators = annotators or list(paths) or available(cid)
+    ret = []
+    for annotator in annotators:
+        df = cg.load_events(cid, annotator, paths.get(annotator))
+        ret.append(pd.concat([
+            df[["sno", "eno"]].assign(
+                speaker=spkr, belief=df[f"belief_{spkr}"], cg=df[f"cg_{spkr}"]
+            ) for spkr in ("A", "B")
+        ]).set_index(["sno", "eno", "speaker"]))
+    ret = pd.concat(ret, axis=1, keys=annotators, join="outer").sort_index()
+    for annotator, family in ret.columns:
+        ret[(annotator, family)] = ret[(annotator, family)].fillna(DEFAULTS[family])
+    return ret
+
+
+def encode(states: pd.DataFrame, family: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes one label family as integer codes into LABELS[family].
+
+    Items where any annotator used a label outside the family are dropped.
+
+    Returns:
+        The (items, annotators) codes and the sno of each item.
+    """
+    annotators = list(states.columns.unique(0))
+    codes = np.stack([
+        pd.Categorical(states[(ann, family)], categories=LABELS[family]).codes
+        for ann in annotators
+    ], axis=1).astype(np.int64)
+    mask = (codes >= 0).all(axis=1)
+    return codes[mask], states.index.get_level_values("sno").to_numpy()[mask]
+
+
+def confusion(
+    a: np.ndarray, b: np.ndarray, k: int, groups: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Counts label pairs in one pass with `np.bincount`.
+
+    Returns:
+        A (k, k) matrix, or (G, k, k) with one matrix per group if groups
+        (integers in [0, G)) are given.
+    """
+    if groups is None:
+        return np.bincount(a * k + b, minlength=k * k).reshape(k, k)
+    ngroups = int(groups.max()) + 1 if len(groups) else 0
+    return np.bincount(
+        (groups * k + a) * k + b, minlength=ngroups * k * k
+    ).reshape(ngroups, k, k)
+
+
+def cohen_kappa(conf: np.ndarray) -> np.ndarray:
+    """
+    Cohen's kappa of one (k, k) or many (..., k, k) confusion matrices.
+    Kappa is NaN where chance agreement is 1 (e.g. one label throughout).
+    """
+    n = conf.sum(axis=(-2, -1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        po = np.trace(conf, axis1=-2, axis2=-1) / n
+        pe = (conf.sum(axis=-1) * conf.sum(axis=-2)).sum(axis=-1) / n**2
+        return np.where(pe < 1, (po - pe) / (1 - pe), np.nan)
+
+
+def fleiss_kappa(
+    codes: np.ndarray, k: int, groups: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Fleiss' kappa of (items, annotators) codes, overall or per group.
+    """
+    nitems, nraters = codes.shape
+    counts = np.bincount(
+        (np.arange(nitems)[:, None] * k + codes).ravel(), minlength=nitems * k
+    ).reshape(nitems, k)
+    agree = ((counts**2).sum(axis=1) - nraters) / (nraters * (nraters - 1))
+    if groups is None:
+        groups = np.zeros(nitems, dtype=np.int64)
+    ngroups = int(groups.max()) + 1 if nitems else 0
+    size = np.bincount(groups, minlength=ngroups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        po = np.bincount(groups, weights=agree, minlength=ngroups) / size
+        props = np.stack([
+            np.bincount(groups, weights=counts[:, j], minlength=ngroups)
+            for j in range(k)
+        ], axis=1) / (size * nraters)[:, None]
+        pe = (props**2).sum(axis=1)
+        return np.where(pe < 1, (po - pe) / (1 - pe), np.nan)
+
+
+def agreement(
+    cid: int,
+    annotators: Optional[list[str]] = None,
+    by_sentence: bool = False,
+    paths: Optional[dict[str, str]] = None,
+) -> pd.DataFrame:
+    """
+    Computes pairwise Cohen's kappa and Fleiss' kappa per label family.
+
+    Args:
+        cid (int): The conversation id.
+        annotators (Optional[list[str]]): Defaults to all available.
+        by_sentence (bool): Compute kappas per sentence instead of overall.
+        paths (Optional[dict[str, str]]): See `load_states`.
+
+    Returns:
+        A frame with family, metric, annotators, (sno,) and kappa columns.
+    """
+    states = load_states(cid, annotators, paths)
+    annotators = list(states.columns.unique(0))
+    if len(annotators) < 2:
+        raise ValueError(f"need at least two annotators for {cid}: {annotators}")
+    ret = []
+    for family, labels in LABELS.items():
+        codes, snos = encode(states, family)
+        groups = snos if by_sentence else None
+        results = {
+            ("cohen", f"{annotators[i]}/{annotators[j]}"): cohen_kappa(
+                confusion(codes[:, i], codes[:, j], len(labels), groups)
+            )
+            for i, j in itertools.combinations(range(len(annotators)), 2)
+        }
+        results[("fleiss", "/".join(annotators))] = fleiss_kappa(
+            codes, len(labels), groups
+        )
+        for (metric, pair), kappa in results.items():
+            kappa = np.atleast_1d(kappa)
+            ret.append(pd.DataFrame({
+                "family": family,
+                "metric": metric,
+                "annotators": pair,
+                "sno": np.arange(len(kappa)) if by_sentence else np.nan,
+                "kappa": kappa,
+            }))
+    ret = pd.concat(ret, ignore_index=True)
+    if by_sentence:
+        return ret[ret.sno.isin(states.index.unique("sno"))].reset_index(drop=True)
+    return ret.drop(columns="sno")
+
+
+def confusion_matrix(
+    cid: int,
+    family: str,
+    annotator_1: str,
+    annotator_2: str,
+    paths: Optional[dict[str, str]] = None,
+) -> pd.DataFrame:
+    """Returns the confusion matrix of two annotators for a label family."""
+    states = load_states(cid, [annotator_1, annotator_2], paths)
+    codes, _ = encode(states, family)
+    labels = list(LABELS[family])
+    return pd.DataFrame(
+        confusion(codes[:, 0], codes[:, 1], len(labels)),
+        index=pd.Index(labels, name=annotator_1),
+        columns=pd.Index(labels, name=annotator_2),
+    )
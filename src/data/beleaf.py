@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*
+import ast
+import collections
+import math
+import os
+import re
+from typing import Any, Optional
+
+import pandas as pd
+
+from ..core.path import dirparent
+from . import cg
+
+
+BELEAF_DIR = os.path.join(dirparent(os.path.realpath(__file__), 3), "data", "beleaf")
+TOKEN = re.compile(r"[^\W_]+")
+BELIEFS = ("true", "ptrue", "unknown", "pfalse", "false")
+DTYPES = {
+    "CID": "int64",
+    "Annotator": "string",
+    "Sentence": "string",
+    "Sno.": "int64",
+    "Preprocessed": "string",
+    "Coref Resolved": "string",
+    "Eno.": "Float64",
+    "Source": "string",
+    "Target": "string",
+    "Belief": pd.CategoricalDtype(BELIEFS),
+    "Event": "string",
+}
+
+
+def _read(name: str) -> pd.DataFrame:
+    # Missing predictions are exported as a single space.
+    return pd.read_csv(os.path.join(BELEAF_DIR, name), dtype=DTYPES, na_values=[" "])
+
+
+def load_raw() -> pd.DataFrame:
+    return _read("cg_raw.csv")
+
+
+def load_triplets() -> pd.DataFrame:
+    """
+    Loads the raw BeLeaF output with TripletOutput parsed into a list of
+    (source, target, belief) tuples.
+    """
+    df = _read("cg_beleaf.csv")
+    df["TripletOutput"] = list(map(ast.literal_eval, df["TripletOutput"]))
+    return df
+
+
+def load_events(coref: bool = False) -> pd.DataFrame:
+    """
+    Loads the events extracted from the BeLeaF triplets.
+
+    Args:
+        coref (bool): Load the events extracted after coreference resolution.
+    """
+    if coref:
+        return _read("cg_beleaf_extracted_events_with_coref.csv")
+    return _read("cg_beleaf_extracted_events.csv")
+
+
+def ngrams(text: str, n: int = 3) -> set[str]:
+    """
+        >>> ngrams("Mae was born.")
+        <<< {" ma", "mae", "ae ", "e w", " wa", ..., "orn", "rn "}
+    """
+    text = " " + " ".join(TOKEN.findall(text.lower())) + " "
+    return {text[idx : idx + n] for idx in range(max(1, len(text) - n + 1))}
+
+
+def load_gold(pairs: list[tuple[int, str]]) -> pd.DataFrame:
+    """Loads the gold (cid, sno, eno) events for (cid, annotator) pairs."""
+    ret = []
+    for cid, annotator in pairs:
+        df = cg.load(cid, annotator)
+        ret.append(pd.DataFrame({
+            "cid": cid,
+            "annotator": annotator,
+            "sno": df["Sno."],
+            "eno": df["Eno."],
+            "event": df["Event"],
+        }))
+    ret = pd.concat(ret)
+    return ret[ret.event != "None"].reset_index(drop=True)
+
+
+class EventAligner:
+    """
+    An inverted index from character n-grams to gold events, scoped per
+    (cid, sno), used to align predicted events to gold by Dice similarity.
+
+    Examples:
+        >>> aligner = EventAligner(load_gold([(4245, "Magda")]))
+        >>> aligner.match(4245, 1, "although they solicit")
+        <<< (1.2, 0.439...)
+    """
+
+    def __init__(self, gold: pd.DataFrame, n: int = 3) -> None:
+        self.n = n
+        self.enos: list[float] = []
+        self.sizes: list[int] = []
+        self.postings: dict[tuple[int, int], dict[str, list[int]]] = (
+            collections.defaultdict(lambda: collections.defaultdict(list))
+        )
+        gold = gold.drop_duplicates(["cid", "eno"])
+        for pos, (cid, eno, event) in enumerate(
+            gold[["cid", "eno", "event"]].itertuples(index=False, name=None)
+        ):
+            grams = ngrams(event, n)
+            self.enos.append(eno)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[(int(cid), math.floor(eno))][gram].append(pos)
+
+    def match(self, cid: int, sno: int, event: Any) -> tuple[float, float]:
+        """
+        Returns the best matching gold eno in the same sentence with its
+        score, or (nan, 0.0) if nothing shares an n-gram.
+        """
+        postings = self.postings.get((cid, sno))
+        if not postings or not isinstance(event, str):
+            return math.nan, 0.0
+        grams = ngrams(event, self.n)
+        shared = collections.Counter(
+            pos for gram in grams for pos in postings.get(gram, ())
+        )
+        best, score = math.nan, 0.0
+        for pos, count in shared.items():
+            if (curr := 2 * count / (len(grams) + self.sizes[pos])) > score:
+                best, score = self.enos[pos], curr
+        return best, score
+
+
+def align(
+    events: pd.DataFrame,
+    gold: Optional[pd.DataFrame] = None,
+    n: int = 3,
+    threshold: float = 0.3,
+) -> pd.DataFrame:
+    """
+    Aligns predicted events to gold events in the same sentence.
+
+    Args:
+        events (pd.DataFrame): Predicted events from `load_events`.
+        gold (Optional[pd.DataFrame]): Gold events with cid, eno and event
+            columns. Loaded with `load_gold` for every (CID, Annotator) in
+            events if not given.
+        n (int): The character n-gram size.
+        threshold (float): The minimum Dice similarity of an alignment.
+
+    Returns:
+        The predicted events with the aligned gold_eno (NaN if unaligned),
+        gold_event and score.
+    """
+    if gold is None:
+        gold = load_gold(
+            list(events[["CID", "Annotator"]].drop_duplicates().itertuples(
+                index=False, name=None
+            ))
+        )
+    aligner = EventAligner(gold, n)
+    matches = [
+        aligner.match(int(cid), int(sno), event)
+        for cid, sno, event in events[["CID", "Sno.", "Event"]].itertuples(
+            index=False, name=None
+        )
+    ]
+    ret = events.assign(
+        gold_eno=[eno if score >= threshold else math.nan for eno, score in matches],
+        score=[score for _, score in matches],
+    )
+    gold = gold.drop_duplicates(["cid", "eno"])[["cid", "eno", "event"]].rename(
+        columns={"cid": "CID", "eno": "gold_eno", "event": "gold_event"}
+    )
+    return ret.merge(gold, how="left", on=["CID", "gold_eno"])
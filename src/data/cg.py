@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*
+import collections
 import itertools
 import math
 import operator
 import os
 from glob import glob
-from typing import Any
+from typing import Any, Iterable, Optional
 
 import pandas as pd
 from more_itertools import one
@@ -58,9 +59,91 @@ def diff_dicts(prev: dict[Any, Any], curr: dict[Any, Any]) -> dict[Any, Any]:
     return dict(curr - prev)
 
 
-def load(cid: int, annotator: str) -> pd.DataFrame:
-    assert cid in CIDS and annotator in ANNOTATORS
-    path = one(glob(os.path.join(CG_DIR, f"{cid}*{annotator}*.tsv")))
+def is_speech_act(wrapper: str, embedded: str) -> bool:
+    """
+    Whether an event is a speech act wrapping the event that follows it.
+
+        >>> is_speech_act("B asks A if A got to see Mae", "A got to see Mae")
+        <<< True
+    """
+    if embedded in ("", "None") or not wrapper.endswith(embedded):
+        return False
+    pretkns = wrapper[: len(wrapper) - len(embedded)].split(" ")
+    if len(pretkns) > 1 and pretkns[1] in ("asks", "jokes"):
+        return True
+    return len(pretkns) > 2 and pretkns[1] == "said" and pretkns[2] == "that"
+
+
+class EventIndex:
+    """
+    The embedding structure of the events in a conversation.
+
+    An event is embedded in the closest preceding event of the same sentence
+    whose text contains it (e.g. 1.2 "The company solicits" in 1.1 "Although
+    the company solicits, ..."). A speech act (e.g. "B asks A if ...") wraps
+    the event listed right after it.
+
+    Attributes:
+        event (dict[float, str]): Event text by eno.
+        parent (dict[float, Optional[float]]): The embedding event by eno.
+        children (dict[float, list[float]]): Embedded events by eno.
+        depth (dict[float, int]): Embedding depth by eno (0 at the top).
+        speech_acts (set[float]): Enos of speech act wrappers.
+        last (dict[int, float]): The final eno of each sentence by sno.
+    """
+
+    def __init__(self, events: Iterable[tuple[float, str]]) -> None:
+        self.event: dict[float, str] = dict(events)
+        self.parent: dict[float, Optional[float]] = {}
+        self.children: dict[float, list[float]] = collections.defaultdict(list)
+        self.depth: dict[float, int] = {}
+        self.speech_acts: set[float] = set()
+        self.last: dict[int, float] = {}
+        sentences = collections.defaultdict(list)
+        for eno in sorted(self.event):
+            sentences[math.floor(eno)].append(eno)
+        for sno, enos in sentences.items():
+            self.last[sno] = enos[-1]
+            enos = [
+                eno for eno in enos
+                if isinstance(self.event[eno], str)
+                and self.event[eno] not in ("", "None")
+            ]
+            for idx, eno in enumerate(enos):
+                self.parent[eno] = next((
+                    prev for prev in reversed(enos[:idx])
+                    if self.event[eno].lower() in self.event[prev].lower()
+                ), None)
+                if (parent := self.parent[eno]) is not None:
+                    self.children[parent].append(eno)
+                self.depth[eno] = 0 if parent is None else self.depth[parent] + 1
+            for left, right in itertools.pairwise(enos):
+                if is_speech_act(self.event[left], self.event[right]):
+                    self.speech_acts.add(left)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "EventIndex":
+        """Builds an index from a `load` or `load_events` frame."""
+        cols = ["eno", "event"] if "eno" in df else ["Eno.", "Event"]
+        return cls(df[cols].drop_duplicates(cols[0]).itertuples(index=False, name=None))
+
+    def frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "eno": list(self.depth),
+            "parent": [self.parent[eno] for eno in self.depth],
+            "depth": list(self.depth.values()),
+            "speech_act": [eno in self.speech_acts for eno in self.depth],
+        })
+
+
+def load(cid: int, annotator: str, path: Optional[str] = None) -> pd.DataFrame:
+    """
+    Loads the annotations for a conversation. If path is given it is read in
+    place of the file for (cid, annotator) in CG_DIR.
+    """
+    if path is None:
+        assert cid in CIDS and annotator in ANNOTATORS
+        path = one(glob(os.path.join(CG_DIR, f"{cid}*{annotator}*.tsv")))
     cols = ["Sentence", "Eno.", "Event", "Bel(A)", "Bel(B)", "CG(A)", "CG(B)"]
     df = pd.read_table(path, usecols=cols).assign(CID=cid, Annotator=annotator)
     df["Sno."] = df["Eno."].transform(math.floor)
@@ -82,12 +165,15 @@ def load(cid: int, annotator: str) -> pd.DataFrame:
     return df.ffill()[rcols]
 
 
-def _load_events(cid: int, annotator: str) -> pd.DataFrame:
-    df = load(cid, annotator)
+def _load_events(
+    cid: int, annotator: str, path: Optional[str] = None
+) -> pd.DataFrame:
+    df = load(cid, annotator, path)
     assert len(df["CID"].unique()) == 1
     ret = []
+    index = EventIndex.from_frame(df)
     # Resolve beliefs based on the the final embedded proposition.
-    df_max_eno = df[df.groupby(["Sno."])["Eno."].transform("max") == df["Eno."]]
+    df_max_eno = df[df["Eno."].isin(index.last.values())]
     for _, row in df_max_eno.iterrows():
         for speaker in ("A", "B"):
             assert len(
@@ -108,7 +194,7 @@ def _load_events(cid: int, annotator: str) -> pd.DataFrame:
     ret_a = ret[ret.speaker == "A"]
     ret_b = ret[ret.speaker == "B"]
     mcols = ["event", "sno", "belief", "cg"]
-    return ret_a[mcols].merge(
+    ret = ret_a[mcols].merge(
         ret_b[mcols],
         how="left" if len(ret_a) > len(ret_b) else "right",
         on=["sno", "event"],
@@ -117,21 +203,31 @@ def _load_events(cid: int, annotator: str) -> pd.DataFrame:
         df.rename(
             columns={"Eno.": "eno", "Event": "event", "CID": "cid"}
         )[["eno", "event", "cid"]], how="left", on="eno"
+    ).merge(index.frame(), how="left", on="eno")
+    # Events annotated without any text have no place in the hierarchy.
+    return ret.assign(
+        depth=ret.depth.fillna(0).astype(int), speech_act=ret.speech_act.eq(True)
     )
 
 
-def load_events(cid: int, annotator: str) -> pd.DataFrame:
+def load_events(
+    cid: int, annotator: str, path: Optional[str] = None
+) -> pd.DataFrame:
     """
     This adds rows before the event happens that have belief_A and belief_B
     as NB. It also considers cg_A and cg_B to be NA (no annotation).
+
+    The parent, depth and speech_act columns come from the conversation's
+    `EventIndex`.
     """
     ret = []
-    df = _load_events(cid, annotator)
+    df = _load_events(cid, annotator, path)
     for eno, data in df.groupby("eno"):
         missing = []
         present = df[df.eno == eno]
         event = one(present.event.unique())
         cid = one(present.cid.unique())
+        tree = present[["parent", "depth", "speech_act"]].iloc[0].to_dict()
         missing_snos = sorted(
             set(range(1, df.sno.max() + 1)) - set(present.sno.unique())
         )
@@ -145,6 +241,6 @@ def load_events(cid: int, annotator: str) -> pd.DataFrame:
                 "cg_B": "NA",
                 "event": event,
                 "cid": cid,
-            })
+            } | tree)
         ret.append(pd.concat([pd.DataFrame(missing), present]).sort_values("sno"))
     return pd.concat(ret).reset_index(drop=True).assign(annotator=annotator)
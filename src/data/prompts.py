@@ -1,12 +1,208 @@
 # -*- coding: utf-8 -*
+import functools
+import math
 import os
+import re
+import string
+from typing import Callable, Optional
 
 from ..core.path import dirparent
 
 
 PROMPT_DIR = os.path.join(dirparent(os.path.realpath(__file__), 3), "data", "prompts")
+# USD per 1K (prompt, completion) tokens.
+PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.005, 0.015),
+}
+MARKER = "🛑"
+# Rough stand-in for BPE when tiktoken isn't installed: words, numbers and
+# single punctuation characters.
+APPROX_TOKEN = re.compile(r"\w+|[^\w\s]")
 
 
 def load(*path: str) -> str:
     with open(os.path.join(PROMPT_DIR, *path), "r") as fd:
         return fd.read().strip()
+
+
+def tokenizer(model: str = "gpt-3.5-turbo") -> Callable[[str], int]:
+    """
+    Returns a function counting the tokens of a string for a model. Uses
+    tiktoken if it is installed and otherwise approximates.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return lambda text: len(APPROX_TOKEN.findall(text))
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text))
+
+
+def price(model: str) -> tuple[float, float]:
+    """
+    Returns the (prompt, completion) price per 1K tokens of a model, or NaNs
+    if it isn't in PRICES.
+    """
+    # Dated snapshots (e.g. gpt-4-0613) are priced like their base model.
+    for name in sorted(PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            return PRICES[name]
+    return math.nan, math.nan
+
+
+class Template:
+    """
+    A prompt template parsed once into literal text and fields so the tokens
+    of its literal text are only counted once.
+
+    Examples:
+        >>> template = Template(load("gpt-zero-shot"))
+        >>> template.format(context="A: Hi 🛑", question="Did A say hi?")
+        >>> template.count(context="A: Hi 🛑", question="Did A say hi?")
+        <<< 55
+    """
+
+    def __init__(
+        self, text: str, count: Optional[Callable[[str], int]] = None
+    ) -> None:
+        self.text = text
+        self.parts = list(string.Formatter().parse(text))
+        self.fields = [field for _, field, _, _ in self.parts if field]
+        self.tokens = functools.lru_cache(maxsize=None)(count or tokenizer())
+        self.static = self.tokens("".join(literal for literal, *_ in self.parts))
+
+    def format(self, **kwargs: str) -> str:
+        return self.text.format(**kwargs)
+
+    def count(self, **kwargs: str) -> int:
+        """
+        Counts the tokens of the formatted template as the sum of its parts.
+        This can differ slightly from counting the whole since BPE may merge
+        across part boundaries.
+        """
+        return self.static + sum(self.tokens(kwargs[field]) for field in self.fields)
+
+
+class PromptBuilder:
+    """
+    Builds prompts whose context is the largest window of sentences around the
+    one marked with 🛑 that fits a token budget.
+
+    Sentence token counts are cached so each distinct sentence is tokenized
+    once no matter how many questions share it.
+
+    Examples:
+        >>> builder = PromptBuilder(load("gpt-zero-shot"), budget=512)
+        >>> builder.window(context.split("\\n"), sno - 1, question)
+        <<< (3, 14)
+        >>> builder.build(context, question)
+    """
+
+    def __init__(
+        self,
+        template: str,
+        budget: int,
+        count: Optional[Callable[[str], int]] = None,
+        max_size: Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            template (str): A template with context and question fields.
+            budget (int): The maximum prompt tokens.
+            count (Optional[Callable[[str], int]]): Counts the tokens of a
+                string (defaults to `tokenizer()`).
+            max_size (Optional[int]): The maximum sentences on either side of
+                the marked one.
+        """
+        self.template = Template(template, count)
+        self.budget = budget
+        self.max_size = max_size
+        self.newline = self.template.tokens("\n")
+
+    def window(
+        self, sentences: list[str], idx: int, question: str
+    ) -> tuple[int, int]:
+        """
+        Grows a window from sentence idx outward, alternating sides, until the
+        next sentence on each side would exceed the budget. The marked sentence
+        is always kept even if it alone is over budget.
+
+        Returns:
+            The [start, end) of the window.
+        """
+        left = self.budget - self.template.count(context="", question=question)
+        left -= self.template.tokens(sentences[idx])
+        start, end = idx, idx + 1
+        grow = {"before": start > 0, "after": end < len(sentences)}
+        while any(grow.values()):
+            for side in ("before", "after"):
+                if not grow[side]:
+                    continue
+                nxt = start - 1 if side == "before" else end
+                size = idx - nxt if side == "before" else nxt - idx
+                cost = self.template.tokens(sentences[nxt]) + self.newline
+                if (self.max_size is not None and size > self.max_size) or cost > left:
+                    grow[side] = False
+                    continue
+                left -= cost
+                if side == "before":
+                    start = nxt
+                    grow[side] = start > 0
+                else:
+                    end = nxt + 1
+                    grow[side] = end < len(sentences)
+        return start, end
+
+    def context(self, context: str, question: str) -> str:
+        """Returns the window of a full context (one sentence per line)."""
+        sentences = context.split("\n")
+        idx = next(i for i, s in enumerate(sentences) if s.endswith(MARKER))
+        start, end = self.window(sentences, idx, question)
+        return "\n".join(sentences[start:end])
+
+    def build(self, context: str, question: str) -> str:
+        return self.template.format(
+            context=self.context(context, question), question=question
+        )
+
+    def count(self, context: str, question: str) -> int:
+        """Counts the prompt tokens of an already windowed context."""
+        tokens = sum(map(self.template.tokens, sentences := context.split("\n")))
+        return (
+            self.template.count(context="", question=question)
+            + tokens + self.newline * (len(sentences) - 1)
+        )
+
+
+def estimate(
+    prompt_tokens: list[int], model: str, completion_tokens: int = 1
+) -> dict[str, float]:
+    """
+    Projects the tokens and cost of sending prompts to a model.
+
+    Args:
+        prompt_tokens (list[int]): The token count of each prompt.
+        model (str): The model name (see `price`).
+        completion_tokens (int): The expected completion tokens per prompt.
+
+    Returns:
+        The number of prompts, total tokens and cost in USD.
+    """
+    prompt_price, completion_price = price(model)
+    total_prompt = sum(prompt_tokens)
+    total_completion = completion_tokens * len(prompt_tokens)
+    return {
+        "prompts": len(prompt_tokens),
+        "prompt_tokens": total_prompt,
+        "max_prompt_tokens": max(prompt_tokens, default=0),
+        "completion_tokens": total_completion,
+        "cost": (
+            total_prompt * prompt_price + total_completion * completion_price
+        ) / 1000,
+    }
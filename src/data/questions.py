@@ -1,17 +1,28 @@
 # -*- coding: utf-8 -*
 import os
 from glob import glob
+from typing import Optional
 
 import pandas as pd
 
+from ..core import artifacts
+from ..core.functional import Filter
 from ..core.path import dirparent
 
 
 QS_DIR = os.path.join(dirparent(os.path.realpath(__file__), 3), "data", "questions")
 
 
-def load() -> pd.DataFrame:
+def load(where: Optional[Filter] = None) -> pd.DataFrame:
+    """
+    Loads the generated questions.
+
+    Args:
+        where (Optional[Filter]): Keeps only the questions it matches, e.g.
+            `Column("order") == 1`.
+    """
     ret = []
-    for path in glob(os.path.join(QS_DIR, "*")):
-        ret.append(pd.read_csv(path))
+    for path in filter(artifacts.is_artifact, glob(os.path.join(QS_DIR, "*"))):
+        df = artifacts.read(path)
+        ret.append(df if where is None else df[where.mask(df)])
     return pd.concat(ret)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*
+import os
+import random
+from typing import Any
+
+import pandas as pd
+
+from . import cg
+
+
+COLUMNS = (
+    "Sentence", "Entity", "Entity(JA)", "Eno.", "Event",
+    "Bel(A)R", "Bel(B)R", "CG(A)R", "CG(B)R", "Pragmatics",
+    "Bel(A)", "Bel(B)", "CG(A)", "CG(B)",
+    "Why(CG)", "Why in prose", "Comment",
+)
+WORDS = (
+    "the company solicits more throughout globe instead of just Japan "
+    "she was induced at hospital kid sister came back to national park "
+    "three times pumping milk in morning books formula nurses told score "
+    "birth mom wants to pass time playing cards filing cabinet Philadelphia"
+).split()
+BELIEF_WEIGHTS = {"CT+": 0.75, "CT-": 0.1, "PS": 0.1, "NB": 0.05}
+CG_WEIGHTS = {"JA": 0.75, "IN": 0.15, "RT": 0.1}
+SPEECH_ACTS = ("{spkr} asks {other} if ", "{spkr} jokes that ", "{spkr} said that ")
+
+
+def _choice(rng: random.Random, weights: dict[str, float]) -> str:
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _fmt(sno: int, idx: int, nevents: int) -> str:
+    return str(sno) if nevents == 1 else f"{sno}.{idx}"
+
+
+def _ann(anns: list[tuple[str, str]]) -> str:
+    return ",".join(f"{lbl} {eno}" for lbl, eno in anns)
+
+
+def _script(
+    rng: random.Random,
+    nturns: int,
+    max_events: int,
+    p_event: float,
+    p_speech_act: float,
+    p_update: float,
+) -> list[dict[str, Any]]:
+    """Returns a conversation with gold annotations as a list of sentences."""
+    ret: list[dict[str, Any]] = []
+    seen: list[str] = []
+    spkr = "A"
+    for sno in range(1, nturns + 1):
+        other = "B" if spkr == "A" else "A"
+        words = rng.choices(WORDS, k=rng.randint(3, 15))
+        events: list[dict[str, Any]] = []
+        nevents = rng.randint(1, max_events) if rng.random() < p_event else 0
+        for idx in range(1, nevents + 1):
+            text = " ".join(rng.sample(words, k=min(len(words), rng.randint(3, 8))))
+            bels = {s: _choice(rng, BELIEF_WEIGHTS) for s in "AB"}
+            events.append({
+                "eno": _fmt(sno, idx, nevents),
+                "event": text,
+                "bel": bels,
+                "cg": {s: _choice(rng, CG_WEIGHTS) for s in "AB"},
+            })
+        # Wrap the last event in a speech act (e.g. "A asks B if ...") which is
+        # listed right before the embedded proposition.
+        if len(events) >= 2 and rng.random() < p_speech_act:
+            wrapper = rng.choice(SPEECH_ACTS).format(spkr=spkr, other=other)
+            events[-2]["event"] = wrapper + events[-1]["event"]
+        # Revise the annotation of an earlier event.
+        updates = []
+        if seen and rng.random() < p_update:
+            updates.append({
+                "eno": rng.choice(seen),
+                "bel": {s: _choice(rng, BELIEF_WEIGHTS) for s in "AB"},
+                "cg": {s: _choice(rng, CG_WEIGHTS) for s in "AB"},
+            })
+        seen += [event["eno"] for event in events]
+        ret.append({
+            "sno": sno,
+            "sentence": f"{spkr}: {' '.join(words)}.",
+            "events": events,
+            "updates": updates,
+        })
+        spkr = other if rng.random() < 0.8 else spkr
+    return ret
+
+
+def _perturb(
+    rng: random.Random, labels: dict[str, str], weights: dict[str, float], p: float
+) -> dict[str, str]:
+    return {
+        spkr: _choice(rng, weights) if rng.random() < p else lbl
+        for spkr, lbl in labels.items()
+    }
+
+
+def _annotate(
+    rng: random.Random, script: list[dict[str, Any]], disagreement: float
+) -> pd.DataFrame:
+    """Renders a script as one annotator's tsv rows."""
+    rows = []
+    for sent in script:
+        enos = [event["eno"] for event in sent["events"]] or [str(sent["sno"])]
+        for idx, eno in enumerate(enos):
+            row = dict.fromkeys(COLUMNS, "")
+            row["Sentence"] = sent["sentence"] if idx == 0 else ""
+            row["Eno."] = eno
+            rows.append(row)
+        anns: dict[str, list[tuple[str, str]]] = {
+            col: [] for col in ("Bel(A)", "Bel(B)", "CG(A)", "CG(B)")
+        }
+        for event in sent["events"] + sent["updates"]:
+            bel = _perturb(rng, event["bel"], BELIEF_WEIGHTS, disagreement)
+            cgs = _perturb(rng, event["cg"], CG_WEIGHTS, disagreement)
+            for spkr in "AB":
+                anns[f"Bel({spkr})"].append((bel[spkr], event["eno"]))
+                anns[f"CG({spkr})"].append((cgs[spkr], event["eno"]))
+        for idx, event in enumerate(sent["events"]):
+            row = rows[len(rows) - len(enos) + idx]
+            row["Event"] = event["event"]
+            for col, ann in anns.items():
+                row[col] = _ann([ann[idx]])
+        # Updates to earlier events go on the last row of the sentence.
+        if sent["updates"]:
+            nupdates = len(sent["updates"])
+            for col, ann in anns.items():
+                rows[-1][col] = _ann(
+                    ([ann[len(enos) - 1]] if sent["events"] else []) + ann[-nupdates:]
+                )
+    return pd.DataFrame(rows, columns=list(COLUMNS))
+
+
+def annotators(n: int) -> list[str]:
+    extra = [f"Synthetic{idx}" for idx in range(len(cg.ANNOTATORS), n)]
+    return list(cg.ANNOTATORS[:n]) + extra
+
+
+def conversation(
+    nturns: int,
+    nannotators: int = 1,
+    max_events: int = 4,
+    p_event: float = 0.6,
+    p_speech_act: float = 0.1,
+    p_update: float = 0.1,
+    disagreement: float = 0.1,
+    seed: int = 42,
+) -> dict[str, pd.DataFrame]:
+    """
+    Generates a synthetic conversation in the raw tsv schema read by `cg.load`.
+
+    Every annotator labels the same sentences and events. Each label is
+    independently resampled with probability `disagreement`.
+
+    Args:
+        nturns (int): The number of sentences.
+        nannotators (int): The number of annotators.
+        max_events (int): The max number of events per sentence (at most 9 so
+            that Eno. values like 3.1 and 3.10 don't collide as floats).
+        p_event (float): The probability a sentence has any events.
+        p_speech_act (float): The probability a sentence with two or more
+            events wraps its last event in a speech act.
+        p_update (float): The probability a sentence revises an earlier event.
+        disagreement (float): The probability an annotator resamples a label.
+        seed (int): The random seed.
+
+    Returns:
+        A mapping from annotator name to tsv rows.
+    """
+    assert 1 <= max_events <= 9
+    rng = random.Random(seed)
+    script = _script(rng, nturns, max_events, p_event, p_speech_act, p_update)
+    return {
+        annotator: _annotate(rng, script, disagreement if idx else 0.0)
+        for idx, annotator in enumerate(annotators(nannotators))
+    }
+
+
+def write(cid: int, outdir: str, **kwargs: Any) -> list[str]:
+    """
+    Writes a synthetic conversation to `{outdir}/{cid}_{annotator}_synthetic.tsv`
+    for every annotator. Takes the same keyword arguments as `conversation`.
+
+    Returns:
+        The paths written.
+    """
+    ret = []
+    os.makedirs(outdir, exist_ok=True)
+    for annotator, df in conversation(**kwargs).items():
+        path = os.path.join(outdir, f"{cid}_{annotator}_synthetic.tsv")
+        df.to_csv(path, sep="\t", index=False)
+        ret.append(path)
+    return ret
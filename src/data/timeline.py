@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*
+import json
+import urllib.parse
+import urllib.request
+from typing import Any, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from . import cg
+from .agreement import available
+
+
+FIELDS = ("belief_A", "belief_B", "cg_A", "cg_B")
+
+
+class Timeline:
+    """
+    The belief states of every event of one (cid, annotator) stored only at
+    the sentences where they change.
+
+    Change points are kept in one array sorted by (event, sno) with integer
+    keys `event << 32 | sno` so the state of any event (or of every event at
+    once) at any sentence is a single binary search.
+
+    Examples:
+        >>> timeline = Timeline.from_events(cg.load_events(4245, "Magda"))
+        >>> timeline.state(1.1, 40)
+        <<< {"belief_A": "CT+", "belief_B": "CT+", "cg_A": "JA", "cg_B": "JA"}
+        >>> timeline.snapshot(40)
+    """
+
+    def __init__(
+        self,
+        enos: np.ndarray,
+        events: list[str],
+        keys: np.ndarray,
+        codes: np.ndarray,
+        labels: list[str],
+        snos: tuple[int, int],
+    ) -> None:
+        self.enos = enos        # (E,) sorted event numbers.
+        self.events = events    # (E,) event text.
+        self.keys = keys        # (C,) sorted event index << 32 | sno.
+        self.codes = codes      # (C, len(FIELDS)) codes into labels (-1 is NaN).
+        self.labels = labels
+        self.snos = snos        # The first and last sno of the conversation.
+
+    @classmethod
+    def from_events(cls, df: pd.DataFrame) -> "Timeline":
+        """Builds a timeline from the output of `cg.load_events`."""
+        df = df.sort_values(["eno", "sno"])
+        labels = sorted(set(df[list(FIELDS)].stack().dropna()))
+        codes = np.stack([
+            pd.Categorical(df[field], categories=labels).codes for field in FIELDS
+        ], axis=1).astype(np.int8)
+        enos, events = df.eno.to_numpy(), df.event.to_numpy()
+        event_idx = np.unique(enos, return_inverse=True)[1]
+        # Keep the first row of each event and rows that differ from the last.
+        change = np.ones(len(df), dtype=bool)
+        change[1:] = (event_idx[1:] != event_idx[:-1]) | (
+            codes[1:] != codes[:-1]
+        ).any(axis=1)
+        first = np.flatnonzero(np.r_[True, event_idx[1:] != event_idx[:-1]])
+        keys = (event_idx.astype(np.int64) << 32) | df.sno.to_numpy(np.int64)
+        return cls(
+            enos[first],
+            list(events[first]),
+            keys[change],
+            codes[change],
+            labels,
+            (int(df.sno.min()), int(df.sno.max())),
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _decode(self, codes: np.ndarray) -> dict[str, Optional[str]]:
+        return {
+            field: self.labels[code] if code >= 0 else None
+            for field, code in zip(FIELDS, codes.tolist())
+        }
+
+    def _lookup(self, event_idx: np.ndarray, sno: int) -> np.ndarray:
+        # The last change point at or before sno of each event (-1 if none).
+        pos = np.searchsorted(
+            self.keys, (event_idx.astype(np.int64) << 32) | sno, side="right"
+        ) - 1
+        valid = pos >= 0
+        valid[valid] = (self.keys[pos[valid]] >> 32) == event_idx[valid]
+        return np.where(valid, pos, -1)
+
+    def state(self, eno: float, sno: int) -> Optional[dict[str, Optional[str]]]:
+        """
+        Returns the state of an event at a sentence or None if the event
+        isn't annotated by then (or doesn't exist).
+        """
+        idx = int(np.searchsorted(self.enos, eno))
+        if idx == len(self.enos) or not np.isclose(self.enos[idx], eno):
+            return None
+        pos = int(self._lookup(np.array([idx]), sno)[0])
+        return None if pos < 0 else self._decode(self.codes[pos])
+
+    def snapshot(self, sno: int) -> pd.DataFrame:
+        """Returns the state of every event annotated by a sentence."""
+        pos = self._lookup(np.arange(len(self.enos)), sno)
+        keep = pos >= 0
+        codes = self.codes[pos[keep]]
+        return pd.DataFrame({
+            "eno": self.enos[keep],
+            "event": np.asarray(self.events, dtype=object)[keep],
+            **{
+                field: pd.Categorical.from_codes(codes[:, col], self.labels)
+                for col, field in enumerate(FIELDS)
+            },
+        })
+
+    def changes(self, eno: float) -> pd.DataFrame:
+        """Returns the change points of an event."""
+        idx = int(np.searchsorted(self.enos, eno))
+        if idx == len(self.enos) or not np.isclose(self.enos[idx], eno):
+            raise KeyError(eno)
+        lo, hi = np.searchsorted(self.keys, [idx << 32, (idx + 1) << 32])
+        return pd.DataFrame({
+            "sno": (self.keys[lo:hi] & 0xFFFFFFFF).astype(int),
+            **{
+                field: pd.Categorical.from_codes(self.codes[lo:hi, col], self.labels)
+                for col, field in enumerate(FIELDS)
+            },
+        })
+
+
+class TimelineIndex:
+    """
+    Timelines of many (cid, annotator) pairs parsed once and kept in memory.
+
+    Examples:
+        >>> index = TimelineIndex.build()
+        >>> index.state(4245, "Magda", eno=1.1, sno=40)
+        >>> index.snapshot(4245, "Magda", sno=40)
+    """
+
+    def __init__(self, timelines: dict[tuple[int, str], Timeline]) -> None:
+        self.timelines = timelines
+
+    @classmethod
+    def build(
+        cls, pairs: Optional[Iterable[tuple[int, str]]] = None
+    ) -> "TimelineIndex":
+        """
+        Args:
+            pairs (Optional[Iterable[tuple[int, str]]]): The (cid, annotator)
+                pairs to load (default: every available annotation).
+        """
+        if pairs is None:
+            pairs = [(cid, ann) for cid in cg.CIDS for ann in available(cid)]
+        return cls({
+            (cid, annotator): Timeline.from_events(cg.load_events(cid, annotator))
+            for cid, annotator in pairs
+        })
+
+    def __getitem__(self, key: tuple[int, str]) -> Timeline:
+        return self.timelines[key]
+
+    def state(
+        self, cid: int, annotator: str, eno: float, sno: int
+    ) -> Optional[dict[str, Optional[str]]]:
+        return self.timelines[(cid, annotator)].state(eno, sno)
+
+    def snapshot(self, cid: int, annotator: str, sno: int) -> pd.DataFrame:
+        return self.timelines[(cid, annotator)].snapshot(sno)
+
+    def summary(self) -> pd.DataFrame:
+        return pd.DataFrame([
+            {
+                "cid": cid,
+                "annotator": annotator,
+                "events": len(timeline.enos),
+                "change_points": len(timeline),
+                "first_sno": timeline.snos[0],
+                "last_sno": timeline.snos[1],
+            }
+            for (cid, annotator), timeline in self.timelines.items()
+        ])
+
+
+def query(url: str, endpoint: str, **params: Any) -> Any:
+    """
+    Queries a running `serve_timelines.py`.
+
+    Examples:
+        >>> query("http://127.0.0.1:8090", "state", cid=4245,
+                  annotator="Magda", eno=1.1, sno=40)
+        <<< {"belief_A": "CT+", "belief_B": "CT+", "cg_A": "JA", "cg_B": "JA"}
+    """
+    url = f"{url.rstrip('/')}/{endpoint}?{urllib.parse.urlencode(params)}"
+    with urllib.request.urlopen(url) as resp:
+        return json.load(resp)